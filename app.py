@@ -1,248 +1,509 @@
-from flask import Flask, render_template, request, jsonify, send_file
-from flask_socketio import SocketIO, emit
+from flask import Flask, Response, render_template, request, jsonify, send_file
+from flask_socketio import SocketIO, emit, join_room, leave_room
 import ssl
 import os
-import base64
-from datetime import datetime
+import sys
 import threading
 import time
+import functools
 import json
-import shutil
-from openai import OpenAI
+from datetime import datetime
 import config
-from weather_art import generate_weather_prompt
-try:
-    from PIL import Image, ImageDraw, ImageFont
-    PIL_AVAILABLE = True
-except ImportError:
-    PIL_AVAILABLE = False
+from history import DEFAULT_DISPLAY, ImageHistory, image_id_for_path
+from derivatives import DerivativeCache
+from jobs import JobQueue, QueueFull, PRIORITY_USER, PRIORITY_SCHEDULED
+from generation import ArchiveSink, GenerationRun, Sink, run_generation
+from partials import PartialBuffer, PartialPlanner, partial_version
+from prompt_cache import PromptCache
+from catalog import Catalog, CatalogSink
+from scheduler import Rule, Scheduler
+from retention import RetentionManager
+from placeholder import get_placeholder, PIL_AVAILABLE
+from storage import atomic_write_json
+import metrics
+from metrics import Counter, Gauge, Histogram
+if not PIL_AVAILABLE:
     print("PIL not available - will create simple placeholder")
 
 app = Flask(__name__)
 app.config['SECRET_KEY'] = 'your-secret-key-here'
-socketio = SocketIO(app, cors_allowed_origins="*")
 
-# Initialize OpenAI client
-client = OpenAI(api_key=config.OPENAI_API_KEY)
+def detect_async_mode():
+    """gevent when launched through serve.py (which monkey-patches first), threads otherwise"""
+    # Only look at gevent if something already imported it; importing it
+    # here would slow down every plain app.py start
+    monkey = sys.modules.get('gevent.monkey')
+    if monkey is None:
+        return 'threading'
+    return 'gevent' if monkey.is_module_patched('socket') else 'threading'
 
-# Current image state
-current_image_path = config.CURRENT_IMAGE
-generation_in_progress = False
+socketio = SocketIO(app, cors_allowed_origins="*", async_mode=detect_async_mode())
 
-# Image history tracking
-IMAGE_HISTORY_FILE = os.path.join(config.BASE_DIR, 'image_history.json')
-MAX_HISTORY = 50  # Keep track of last 50 images
-CURRENT_POSITION_FILE = os.path.join(config.BASE_DIR, 'current_position.json')
+# Every configured frame, plus the default kiosk, which always exists. Each
+# display is a Socket.IO room with its own position in the shared history
+DISPLAY_NAMES = list(dict.fromkeys([DEFAULT_DISPLAY, *config.DISPLAYS]))
+GENERATED_WIDTH = int(config.IMAGE_GENERATION_SIZE.split('x')[0])
 
-def load_current_position():
-    """Load current position in history"""
-    if os.path.exists(CURRENT_POSITION_FILE):
-        try:
-            with open(CURRENT_POSITION_FILE, 'r') as f:
-                data = json.load(f)
-                return data.get('position', 0)
-        except:
-            return 0
-    return 0
-
-def save_current_position(position):
-    """Save current position in history"""
-    with open(CURRENT_POSITION_FILE, 'w') as f:
-        json.dump({'position': position}, f)
-
-def load_image_history():
-    """Load image history from file"""
-    if os.path.exists(IMAGE_HISTORY_FILE):
-        try:
-            with open(IMAGE_HISTORY_FILE, 'r') as f:
-                return json.load(f)
-        except:
-            return []
-    return []
-
-def save_image_history(history):
-    """Save image history to file"""
-    with open(IMAGE_HISTORY_FILE, 'w') as f:
-        json.dump(history, f)
-
-def add_to_history(image_path):
-    """Add image to history"""
-    history = load_image_history()
-    
-    # Add new image to the front
-    history.insert(0, {
-        'path': image_path,
-        'timestamp': datetime.now().isoformat()
-    })
-    
-    # Keep only MAX_HISTORY items
-    history = history[:MAX_HISTORY]
-    
-    save_image_history(history)
-    
-    # Reset position to 0 when new image is added
-    save_current_position(0)
-    
-    return history
+# Image history tracking (kept in memory, flushed to SQLite in the background).
+# The JSON files are only read once, to migrate older installs
+IMAGE_HISTORY_FILE = os.path.join(config.DATA_DIR, 'image_history.json')
+CURRENT_POSITION_FILE = os.path.join(config.DATA_DIR, 'current_position.json')
+history = ImageHistory(config.STATE_DB, flush_delay=config.HISTORY_FLUSH_DELAY,
+                       legacy_history_file=IMAGE_HISTORY_FILE,
+                       legacy_position_file=CURRENT_POSITION_FILE,
+                       displays=DISPLAY_NAMES)
 
-def get_previous_image():
-    """Get the previous image from history"""
-    history = load_image_history()
-    current_pos = load_current_position()
-    
-    # Move to previous position
-    new_pos = current_pos + 1
-    
-    # Check if we have a valid previous image
-    if new_pos < len(history) and os.path.exists(history[new_pos]['path']):
-        save_current_position(new_pos)
-        return history[new_pos]['path']
-    
-    return None
+# Prompt, weather and favorites for every archived image, searchable
+catalog = Catalog(config.STATE_DB)
 
-def get_next_image():
-    """Get the next image from history"""
-    history = load_image_history()
-    current_pos = load_current_position()
-    
-    # Move to next position
-    new_pos = current_pos - 1
-    
-    # Check if we have a valid next image
-    if new_pos >= 0 and new_pos < len(history) and os.path.exists(history[new_pos]['path']):
-        save_current_position(new_pos)
-        return history[new_pos]['path']
-    
-    return None
-
-def create_placeholder_image():
-    """Create a simple placeholder image"""
-    if PIL_AVAILABLE:
-        # Create a gradient background
-        width, height = 1536, 1024
-        img = Image.new('RGB', (width, height))
-        draw = ImageDraw.Draw(img)
-        
-        # Create a gradient from dark blue to purple
-        for y in range(height):
-            r = int(30 + (y / height) * 50)
-            g = int(40 + (y / height) * 30)
-            b = int(80 + (y / height) * 100)
-            draw.rectangle([(0, y), (width, y+1)], fill=(r, g, b))
-        
-        # Add some text
-        try:
-            # Try to use a nice font if available
-            font = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf", 60)
-        except:
-            # Fall back to default font
-            font = ImageFont.load_default()
-        
-        text = "Art Display"
-        text_bbox = draw.textbbox((0, 0), text, font=font)
-        text_width = text_bbox[2] - text_bbox[0]
-        text_height = text_bbox[3] - text_bbox[1]
-        
-        # Center the text
-        x = (width - text_width) // 2
-        y = (height - text_height) // 2
-        
-        # Draw text with shadow
-        draw.text((x+3, y+3), text, fill=(0, 0, 0, 128), font=font)
-        draw.text((x, y), text, fill=(255, 255, 255), font=font)
-        
-        # Add subtitle
-        subtitle = "Initializing..."
-        try:
-            subtitle_font = ImageFont.truetype("/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf", 30)
-        except:
-            subtitle_font = ImageFont.load_default()
-        
-        subtitle_bbox = draw.textbbox((0, 0), subtitle, font=subtitle_font)
-        subtitle_width = subtitle_bbox[2] - subtitle_bbox[0]
-        sx = (width - subtitle_width) // 2
-        sy = y + text_height + 40
-        
-        draw.text((sx, sy), subtitle, fill=(200, 200, 200), font=subtitle_font)
-        
-        # Save the image
-        img.save(current_image_path)
-        print(f"Created placeholder image at {current_image_path}")
-    else:
-        # Create a simple 1x1 black pixel as fallback
-        print("Creating minimal placeholder (PIL not available)")
-        with open(current_image_path, 'wb') as f:
-            # PNG header for a 1x1 black image
-            f.write(b'\x89PNG\r\n\x1a\n\x00\x00\x00\rIHDR\x00\x00\x00\x01\x00\x00\x00\x01\x08\x00\x00\x00\x00:~\x9bU\x00\x00\x00\x0bIDATx\x9cc\xf8\x00\x00\x00\x01\x00\x01UU\x86\x18\x00\x00\x00\x00IEND\xaeB`\x82')
+# Partials of the generation in progress; kept in memory, never on disk
+partial_buffer = PartialBuffer(config.PARTIAL_BUFFER_SIZE)
+
+# How many partials to ask for, from how fast displays have been receiving them
+partial_planner = PartialPlanner(config.PARTIAL_IMAGES, *config.PARTIAL_IMAGES_RANGE)
+
+# Previously generated images, reused for repeated prompts
+prompt_cache = PromptCache(config.PROMPT_CACHE_FILE, ttl=config.PROMPT_CACHE_TTL)
+
+# Display-sized variants of archived art, rendered lazily or right after generation.
+# Frames narrower than the generated image get a variant at exactly their width
+derivatives = DerivativeCache(config.DERIVATIVE_CACHE_DIR,
+                              max_bytes=config.DERIVATIVE_CACHE_MAX_BYTES,
+                              widths=set(config.DERIVATIVE_WIDTHS) | {
+                                  settings['width'] for settings in config.DISPLAYS.values()
+                                  if settings.get('width', GENERATED_WIDTH) < GENERATED_WIDTH},
+                              formats=config.DERIVATIVE_FORMATS,
+                              quality=config.DERIVATIVE_QUALITY,
+                              workers=config.DERIVATIVE_WORKERS)
+
+# Scheduled art that is already generated but not yet on display,
+# image id -> {'id', 'path', 'reveal_at', 'prompt', 'source'}; kiosks prefetch
+# these ahead of time. Saved to disk so a restart still reveals them
+pending_reveals = {}
+
+# Latest heartbeat from each display page, client name -> {'display', 'version', 'at'};
+# display.py restarts the kiosk's Chromium when its heartbeats stop
+heartbeats = {}
+MAX_HEARTBEAT_CLIENTS = 50
+STARTED_AT = time.time()
+# When the Socket.IO server last pushed a pulse through its emit path
+last_socket_pulse = None
+
+# Instrumentation, scraped from /metrics
+HTTP_REQUEST_SECONDS = Histogram('art_http_request_seconds',
+                                 'Time to build an image response (excludes the transfer)', ['route'])
+SOCKET_HANDLER_SECONDS = Histogram('art_socket_handler_seconds', 'Socket.IO event handler time',
+                                   ['event'])
+CONNECTED_CLIENTS = Gauge('art_connected_clients', 'Socket.IO clients currently connected')
+HISTORY_SIZE = Gauge('art_history_images', 'Images in history', func=lambda: len(history))
+QUEUE_DEPTH = Gauge('art_generation_queue_depth', 'Generation jobs waiting to run',
+                    func=lambda: generation_queue.depth())
+JOB_STATUS = Counter('art_generation_jobs', 'Generation job state changes', ['source', 'status'])
+CONNECT_SYNCS = Counter('art_connect_syncs', 'Connect handshakes by what the client was sent',
+                        ['result'])
+PARTIALS_PLANNED = Gauge('art_partials_planned', 'Partial images requested for the latest generation')
+PARTIALS_SKIPPED = Counter('art_partials_skipped', 'Partials not relayed because no display was watching')
+
+def resolve_displays(name):
+    """Displays an event applies to: [name], or None (every display) when no name is given"""
+    if not name:
+        return None
+    if name not in DISPLAY_NAMES:
+        raise ValueError(f"Unknown display: {name}")
+    return [name]
+
+def display_room(display):
+    return f'display:{display}'
+
+CONTROL_ROOM = 'control'  # Control pages, which hear about every job
+
+def display_variant(display):
+    """(width, format) of the images sent to a display; None means full size / negotiated"""
+    settings = config.DISPLAYS.get(display) or {}
+    width = settings.get('width')
+    if width and width >= GENERATED_WIDTH:
+        width = None  # The full-size image already fits
+    return derivatives.snap_width(width), settings.get('format')
+
+def variant_query(display):
+    """Query string selecting a display's variant, e.g. 'w=1024&fmt=webp'"""
+    width, fmt = display_variant(display)
+    params = []
+    if width:
+        params.append(f'w={width}')
+    if fmt:
+        params.append(f'fmt={fmt}')
+    return '&'.join(params)
+
+def current_image_path(display=DEFAULT_DISPLAY):
+    """The archived file a display shows; navigation just moves its history position"""
+    entry = history.current(display)
+    return entry['path'] if entry else None
+
+def current_image_version(display=DEFAULT_DISPLAY):
+    """Short version tag for a display's current image, used by clients to bust caches"""
+    partial = partial_buffer.latest(display)
+    if partial:
+        return partial['version']
+    path = current_image_path(display)
+    if not path:
+        return None
+    try:
+        stat = os.stat(path)
+    except OSError:
+        return None
+    return f"{stat.st_mtime_ns:x}-{stat.st_size:x}"
+
+# Path of the placeholder, found (or rendered) once at startup
+_placeholder_path = None
+
+def placeholder_image_path(refresh=False):
+    """Cached placeholder shown until the first artwork exists
+
+    The path is remembered, so serving an image doesn't hash or stat
+    anything; refresh re-renders it if the file has gone missing.
+    """
+    global _placeholder_path
+    if _placeholder_path is None or refresh:
+        _placeholder_path = get_placeholder(config.IMAGES_DIR)
+    return _placeholder_path
 
 def ensure_directories():
     """Ensure all required directories exist"""
     os.makedirs(config.IMAGES_DIR, exist_ok=True)
     os.makedirs('certs', exist_ok=True)
     
-    # Create placeholder image if none exists
-    if not os.path.exists(current_image_path):
-        print("No current image found, creating placeholder...")
-        create_placeholder_image()
-        add_to_history(current_image_path)
-        save_current_position(0)
+    # Previews used to be written next to the archive; they're memory-only now.
+    # Older installs also recorded current.png in the history, so drop those
+    # entries too or navigating back would land on a missing file
+    legacy_ids = {'current'}
+    for name in os.listdir(config.IMAGES_DIR):
+        if name == 'current.png' or (name.startswith('partial_') and name.endswith('.png')):
+            os.remove(os.path.join(config.IMAGES_DIR, name))
+            legacy_ids.add(image_id_for_path(name))
+    history.remove(legacy_ids)
+    
+    # Show the placeholder if there is no image yet
+    placeholder = placeholder_image_path(refresh=True)
+    path = current_image_path()
+    if not path or not os.path.exists(path):
+        print("No current image found, using placeholder...")
+        history.add(placeholder)
 
 @app.route('/')
 def display():
     """Main display page - shows current artwork"""
-    return render_template('index.html')
+    return render_template('index.html', heartbeat_seconds=config.DISPLAY_HEARTBEAT_SECONDS)
 
 @app.route('/control')
 def control():
     """Control interface for phones"""
-    return render_template('control.html')
+    return render_template('control.html', displays=DISPLAY_NAMES)
 
 @app.route('/current-image')
+@HTTP_REQUEST_SECONDS.time(route='/current-image')
 def get_current_image():
-    """Serve the current display image"""
-    if os.path.exists(current_image_path):
-        return send_file(current_image_path, mimetype='image/png')
+    """Serve a display's current image (?display=, the kiosk by default) from the archive"""
+    display = request.args.get('display') or DEFAULT_DISPLAY
+    if display not in DISPLAY_NAMES:
+        return jsonify({'error': 'Unknown display'}), 404
+    partial = partial_buffer.latest(display)
+    if partial:
+        # Mid-generation, late joiners get the newest partial from memory;
+        # it changes too often to be worth resizing
+        response = Response(partial['image'].bytes, mimetype='image/png')
+        response.set_etag(partial['version'])
+        response.cache_control.max_age = 0
+        return response.make_conditional(request)
+    # send_file handles ETag/Last-Modified and answers 304 on revalidation
+    path = current_image_path(display)
+    if not path or not os.path.exists(path):
+        # If somehow the image doesn't exist, fall back to the placeholder
+        path = placeholder_image_path(refresh=True)
+    if path == placeholder_image_path():
+        # The placeholder should paint without waiting on an encoder
+        return send_file(path, conditional=True, etag=True, max_age=0)
+    return send_image_variant(path, max_age=0, display=display)
+
+@app.route('/image/<image_id>')
+@HTTP_REQUEST_SECONDS.time(route='/image')
+def get_archived_image(image_id):
+    """Serve an archived image, resized with ?w= and encoded as ?fmt= or per Accept"""
+    entry = history.get(image_id) or pending_reveals.get(image_id)
+    if not entry or not os.path.exists(entry['path']):
+        return jsonify({'error': 'Image not found'}), 404
+    # Archived images never change under the same ID
+    response = send_image_variant(entry['path'], max_age=31536000)
+    response.cache_control.immutable = True
+    return response
+
+@app.route('/metrics')
+def get_metrics():
+    """Prometheus scrape endpoint"""
+    return Response(metrics.render(), mimetype='text/plain; version=0.0.4')
+
+@app.route('/healthz')
+def healthz():
+    """Readiness probe for display.py
+
+    Ready once there is an image on disk to serve for every display and
+    the Socket.IO server's background pulse is recent, which shows its
+    emit path and background tasks are still running; also reports how
+    long ago each display page last sent a heartbeat.
+    """
+    now = time.time()
+    images = {}
+    for display in DISPLAY_NAMES:
+        path = current_image_path(display)
+        images[display] = bool(path) and os.path.exists(path)
+    pulse_age = now - last_socket_pulse if last_socket_pulse is not None else None
+    socket_live = pulse_age is not None and pulse_age <= 3 * config.DISPLAY_HEARTBEAT_SECONDS
+    ready = socket_live and all(images.values())
+    return jsonify({
+        'ready': ready,
+        'images': images,
+        'socket': {'live': socket_live, 'async_mode': socketio.async_mode,
+                   'pulse_age': round(pulse_age, 1) if pulse_age is not None else None,
+                   'clients': CONNECTED_CLIENTS.value()},
+        'heartbeats': {client: {'display': beat['display'], 'version': beat['version'],
+                                'age': round(now - beat['at'], 1)}
+                       for client, beat in list(heartbeats.items())},
+        'partials': partial_planner.stats(),
+        'uptime': round(now - STARTED_AT, 1)
+    }), 200 if ready else 503
+
+@app.route('/api/history')
+def get_history_page():
+    """Paginated history for the control page gallery, newest first"""
+    cursor = request.args.get('cursor') or None
+    limit = max(1, min(request.args.get('limit', 50, type=int), 200))
+    display = request.args.get('display') or DEFAULT_DISPLAY
+    if display not in DISPLAY_NAMES:
+        return jsonify({'error': 'Unknown display'}), 404
+    entries, next_cursor = history.page(cursor, limit)
+    current = history.current(display)
+    favorites = catalog.favorite_ids()
+    return jsonify({
+        'images': [{
+            'id': entry['id'],
+            'timestamp': entry['timestamp'],
+            'prompt': entry.get('prompt'),
+            'favorite': entry['id'] in favorites,
+            'url': f"/image/{entry['id']}",
+            'thumbnail_url': f"/image/{entry['id']}?w={config.THUMBNAIL_WIDTH}"
+        } for entry in entries],
+        'next_cursor': next_cursor,
+        'current_id': current['id'] if current else None
+    })
+
+def catalog_image(entry):
+    """JSON form of a catalog entry for the API"""
+    return {
+        'id': entry['id'],
+        'timestamp': entry['created'],
+        'prompt': entry['prompt'],
+        'source': entry['source'],
+        'weather': entry['weather'],
+        'width': entry['width'],
+        'height': entry['height'],
+        'favorite': entry['favorite'],
+        'url': f"/image/{entry['id']}",
+        'thumbnail_url': f"/image/{entry['id']}?w={config.THUMBNAIL_WIDTH}"
+    }
+
+@app.route('/api/search')
+def search_catalog():
+    """Full-text search over the prompts of every archived image"""
+    query = request.args.get('q', '')
+    limit = max(1, min(request.args.get('limit', 50, type=int), 200))
+    return jsonify({'images': [catalog_image(entry) for entry in catalog.search(query, limit)]})
+
+@app.route('/api/favorites')
+def get_favorites():
+    """Favorite images, newest first"""
+    limit = max(1, min(request.args.get('limit', 50, type=int), 200))
+    return jsonify({'images': [catalog_image(entry) for entry in catalog.favorites(limit)]})
+
+@app.route('/api/favorites/random')
+def get_random_favorite():
+    """One favorite picked at random"""
+    entry = catalog.random_favorite()
+    if entry is None:
+        return jsonify({'error': 'No favorites yet'}), 404
+    return jsonify(catalog_image(entry))
+
+@app.route('/api/on-this-day')
+def get_on_this_day():
+    """Images made on the same day last year"""
+    return jsonify({'images': [catalog_image(entry) for entry in catalog.same_day_last_year()]})
+
+@app.route('/api/storage')
+def get_storage():
+    """Archive size against the retention budget, and space reclaimed so far"""
+    return jsonify(retention.stats())
+
+def image_ref(entry, display=None):
+    """Stable, cacheable reference to an archived image, sized for a display if given"""
+    if not entry:
+        return None
+    query = variant_query(display) if display else ''
+    return {'id': entry['id'], 'url': f"/image/{entry['id']}" + (f'?{query}' if query else '')}
+
+def build_manifest(display=DEFAULT_DISPLAY):
+    """The images a display is likely to show next, for prefetching"""
+    upcoming = [dict(image_ref(pending, display), reveal_at=pending['reveal_at'].isoformat())
+                for pending in list(pending_reveals.values())]
+    return {
+        'display': display,
+        'current': image_ref(history.current(display), display),
+        'previous': image_ref(history.peek(1, display), display),
+        'next': image_ref(history.peek(-1, display), display),
+        'upcoming': upcoming,
+        'queued': generation_queue.depth(),
+        'scheduled': scheduler.upcoming()
+    }
+
+def broadcast_manifest(displays=None):
+    """Send displays (all by default) their prefetch manifest after their image changes"""
+    for display in displays or DISPLAY_NAMES:
+        socketio.emit('manifest', build_manifest(display), to=display_room(display))
+
+def announce_image(display, message, **extra):
+    """Tell a display's room that it now shows its current history entry"""
+    entry = history.current(display)
+    if not entry:
+        return
+    socketio.emit('image_update', dict({
+        'status': 'changed',
+        'display': display,
+        'version': current_image_version(display),
+        'image_id': entry['id'],
+        'url': image_ref(entry, display)['url'],
+        'message': message
+    }, **extra), to=display_room(display))
+
+def prewarm_for_displays(path):
+    """Render an image for each display's size, plus the default variants"""
+    derivatives.prewarm(path)
+    for display in DISPLAY_NAMES:
+        width, fmt = display_variant(display)
+        derivatives.prewarm(path, widths=[width], formats=[fmt] if fmt else None)
+
+def accel_redirect(path, max_age):
+    """Hand the file back to nginx, which sends it with sendfile() (zero-copy)"""
+    relative = os.path.relpath(path, config.IMAGES_DIR).replace(os.sep, '/')
+    response = app.response_class()
+    response.headers['X-Accel-Redirect'] = config.ACCEL_REDIRECT_PREFIX + relative
+    # nginx fills in the type, length and validators from the file itself
+    del response.headers['Content-Type']
+    response.cache_control.public = True
+    response.cache_control.max_age = max_age
+    return response
+
+def send_image_variant(source_path, max_age, display=None):
+    """Send the derivative of an image that best matches the request
+
+    A display's configured size and format apply unless ?w= or ?fmt= override them.
+    """
+    default_width, default_fmt = display_variant(display) if display else (None, None)
+    width = derivatives.snap_width(request.args.get('w', type=int) or default_width)
+    fmt = derivatives.negotiate_format(request.headers.get('Accept'),
+                                       request.args.get('fmt') or default_fmt)
+    path = source_path
+    if fmt:
+        try:
+            path = derivatives.get(source_path, width, fmt)
+        except Exception as e:
+            print(f"Could not render variant of {source_path}: {e}")
+    if config.ACCEL_REDIRECT_PREFIX:
+        response = accel_redirect(path, max_age)
     else:
-        # If somehow the image doesn't exist, create it
-        create_placeholder_image()
-        return send_file(current_image_path, mimetype='image/png')
+        response = send_file(path, conditional=True, etag=True, max_age=max_age)
+    response.vary.add('Accept')
+    return response
 
 @socketio.on('generate_image')
+@SOCKET_HANDLER_SECONDS.time(event='generate_image')
 def handle_generate_image(data):
     """Handle image generation request from phone"""
-    global generation_in_progress
-    
-    if generation_in_progress:
-        emit('generation_status', {'status': 'busy', 'message': 'Generation already in progress'})
-        return
-    
-    prompt = data.get('prompt', '')
+    prompt = data.get('prompt', '').strip()
     if not prompt:
         emit('generation_status', {'status': 'error', 'message': 'No prompt provided'})
         return
     
+    try:
+        # Without a display the new art goes to every frame
+        displays = resolve_displays(data.get('display'))
+    except ValueError as e:
+        emit('generation_status', {'status': 'error', 'message': str(e)})
+        return
+    
     # Add artistic style to prompt
     full_prompt = f"{prompt}, {config.DEFAULT_STYLE}"
+    force_fresh = bool(data.get('force_fresh'))
+    
+    # Serve repeated prompts straight from the cache without queueing; the
+    # path found here is the one shown, so nothing is generated in the handler
+    cached_path = None if force_fresh else prompt_cache.get(full_prompt)
+    if cached_path:
+        run = run_generation(full_prompt, generation_sinks(displays), cached_path=cached_path)
+        display = (displays or DISPLAY_NAMES)[0]
+        emit('generation_status', {
+            'status': 'complete',
+            'message': 'Image loaded from cache',
+            'cached': True,
+            'image_url': f'/current-image?display={display}',
+            'version': current_image_version(display),
+            'image_id': image_id_for_path(run.archive_path)
+        })
+        return
+    
+    # Queue generation; user prompts run ahead of scheduled weather art
+    try:
+        job = generation_queue.submit(functools.partial(generate_and_broadcast_image,
+                                                        force_fresh=force_fresh),
+                                      priority=PRIORITY_USER,
+                                      source='user',
+                                      prompt=full_prompt,
+                                      displays=displays)
+    except QueueFull:
+        emit('generation_status', {'status': 'busy', 'message': 'Generation queue is full'})
+        return
     
-    # Start generation in background
-    thread = threading.Thread(target=generate_and_broadcast_image, args=(full_prompt,))
-    thread.start()
+    emit('job_submitted', {'job_id': job.id, 'position': generation_queue.position(job.id)})
+
+@socketio.on('cancel_generation')
+@SOCKET_HANDLER_SECONDS.time(event='cancel_generation')
+def handle_cancel_generation(data):
+    """Handle request to cancel a queued or running generation"""
+    job_id = (data or {}).get('job_id', '')
+    if not generation_queue.cancel(job_id):
+        emit('generation_status', {
+            'status': 'error',
+            'job_id': job_id,
+            'message': 'No such generation job'
+        })
+
+@socketio.on('queue_status')
+@SOCKET_HANDLER_SECONDS.time(event='queue_status')
+def handle_queue_status():
+    """Send the list of queued and running jobs to the requester"""
+    emit('queue_status', {'jobs': generation_queue.snapshot()})
 
 @socketio.on('previous_image')
-def handle_previous_image():
-    """Handle request to show previous image"""
+@SOCKET_HANDLER_SECONDS.time(event='previous_image')
+def handle_previous_image(data=None):
+    """Handle request to show previous image (on one display, or on all of them)"""
     try:
-        previous_path = get_previous_image()
+        displays = resolve_displays((data or {}).get('display'))
+        moved = [display for display in displays or DISPLAY_NAMES
+                 if history.previous(display)]
         
-        if previous_path and os.path.exists(previous_path):
-            # Copy previous image to current
-            shutil.copy2(previous_path, current_image_path)
-            
-            # Notify all clients
-            socketio.emit('image_update', {
-                'status': 'changed',
-                'message': 'Previous image loaded'
-            })
+        if moved:
+            # Notify the affected displays
+            for display in moved:
+                announce_image(display, 'Previous image loaded')
+            broadcast_manifest(moved)
             
             emit('previous_status', {
                 'status': 'success',
@@ -260,20 +521,19 @@ def handle_previous_image():
         })
 
 @socketio.on('next_image')
-def handle_next_image():
-    """Handle request to show next image"""
+@SOCKET_HANDLER_SECONDS.time(event='next_image')
+def handle_next_image(data=None):
+    """Handle request to show next image (on one display, or on all of them)"""
     try:
-        next_path = get_next_image()
+        displays = resolve_displays((data or {}).get('display'))
+        moved = [display for display in displays or DISPLAY_NAMES
+                 if history.next(display)]
         
-        if next_path and os.path.exists(next_path):
-            # Copy next image to current
-            shutil.copy2(next_path, current_image_path)
-            
-            # Notify all clients
-            socketio.emit('image_update', {
-                'status': 'changed',
-                'message': 'Next image loaded'
-            })
+        if moved:
+            # Notify the affected displays
+            for display in moved:
+                announce_image(display, 'Next image loaded')
+            broadcast_manifest(moved)
             
             emit('next_status', {
                 'status': 'success',
@@ -290,112 +550,545 @@ def handle_next_image():
             'message': f'Error loading next image: {str(e)}'
         })
 
-def generate_and_broadcast_image(prompt):
-    """Generate image with streaming and broadcast updates"""
-    global generation_in_progress
-    generation_in_progress = True
-    
+@socketio.on('jump_to_image')
+@SOCKET_HANDLER_SECONDS.time(event='jump_to_image')
+def handle_jump_to_image(data):
+    """Handle request to show any image from the history gallery"""
     try:
-        socketio.emit('generation_status', {'status': 'starting', 'message': 'Starting image generation...'})
-        
-        # Create streaming request using the new API format
-        stream = client.responses.create(
-            model="gpt-4.1",
-            input=prompt,
-            stream=True,
-            tools=[{"type": "image_generation", 
-                    "partial_images": config.PARTIAL_IMAGES,
-                    "quality":"high",
-                    "moderation":"low",
-                    "size":"1536x1024"
-                    }
-                    ],
-        )
+        image_id = data.get('image_id', '')
+        displays = resolve_displays(data.get('display'))
+        entry = history.get(image_id)
+        if entry is None:
+            # Search results can include archives that aren't in the history yet
+            found = catalog.get(image_id)
+            if found and os.path.exists(found['path']):
+                entry = history.add(found['path'], prompt=found['prompt'], source=found['source'],
+                                    displays=displays)
         
-        # Process stream
-        partial_count = 0
-        final_image_data = None
-        
-        for event in stream:
-            if event.type == "response.image_generation_call.partial_image":
-                idx = event.partial_image_index
-                image_base64 = event.partial_image_b64
-                image_bytes = base64.b64decode(image_base64)
-                
-                # Save as current image
-                with open(current_image_path, 'wb') as f:
-                    f.write(image_bytes)
-                
-                # Save partial image
-                partial_path = os.path.join(config.IMAGES_DIR, f'partial_{idx}.png')
-                with open(partial_path, 'wb') as f:
-                    f.write(image_bytes)
-                
-                # Broadcast update
-                socketio.emit('image_update', {
-                    'status': 'partial',
-                    'partial_index': idx,
-                    'image_data': f"data:image/png;base64,{image_base64}"
-                })
-                
-                final_image_data = image_base64
-                partial_count += 1
-        
-        # Save final image with timestamp
-        if final_image_data:
-            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-            archive_path = os.path.join(config.IMAGES_DIR, f'art_{timestamp}.png')
-            final_bytes = base64.b64decode(final_image_data)
-            with open(archive_path, 'wb') as f:
-                f.write(final_bytes)
+        if entry:
+            for display in displays or DISPLAY_NAMES:
+                history.jump(entry['id'], display)
+                announce_image(display, 'Image loaded')
+            broadcast_manifest(displays)
             
-            # Add to history
-            add_to_history(archive_path)
-        
-        socketio.emit('generation_status', {
-            'status': 'complete',
-            'message': 'Image generation complete!',
-            'image_url': '/current-image'
-        })
-        
+            emit('jump_status', {
+                'status': 'success',
+                'image_id': entry['id'],
+                'message': 'Image loaded'
+            })
+        else:
+            emit('jump_status', {
+                'status': 'error',
+                'message': 'Image not found in history'
+            })
     except Exception as e:
-        socketio.emit('generation_status', {
+        emit('jump_status', {
             'status': 'error',
-            'message': f'Error generating image: {str(e)}'
+            'message': f'Error loading image: {str(e)}'
         })
-    finally:
-        generation_in_progress = False
+
+@socketio.on('set_favorite')
+@SOCKET_HANDLER_SECONDS.time(event='set_favorite')
+def handle_set_favorite(data):
+    """Mark or unmark an image as a favorite"""
+    image_id = data.get('image_id', '')
+    favorite = bool(data.get('favorite', True))
+    if catalog.set_favorite(image_id, favorite):
+        socketio.emit('favorite_status', {'image_id': image_id, 'favorite': favorite})
+    else:
+        emit('favorite_status', {'status': 'error', 'image_id': image_id,
+                                 'message': 'Image not found in catalog'})
+
+class PreviewSink(Sink):
+    """Shows partials on the target displays as they stream in
+
+    Partials only live in the in-memory buffer; the archive sink writes
+    the final image, once. displays=None targets every display.
+    """
+    
+    def __init__(self, displays=None):
+        self.displays = displays
+    
+    def on_partial(self, run, index, partial):
+        # Still base64; it's decoded only if a late joiner asks for it
+        partial_buffer.add(run.id, index, partial, self.displays)
+    
+    def on_final(self, run, image_bytes):
+        # History has already pointed the displays at the archived file
+        partial_buffer.finish(run.id)
+    
+    def on_abort(self, run, error):
+        if partial_buffer.finish(run.id):
+            restore_current_image(self.displays)
+
+class BroadcastSink(Sink):
+    """Pushes partials and the finished image to the target displays' rooms"""
+    
+    def __init__(self, displays=None):
+        self.displays = displays
+    
+    def on_partial(self, run, index, partial):
+        watching = subscribed_displays(self.displays)
+        if not watching:
+            # Nobody to show it to: skip the decode and the packet entirely
+            PARTIALS_SKIPPED.inc()
+            return
+        # Broadcast raw bytes as a binary attachment; the packet is
+        # encoded once and reused for every display in the rooms
+        version = partial_version(run.id, index)
+        image_bytes = partial.bytes
+        socketio.emit('image_update', {
+            'status': 'partial',
+            'job_id': run.id,
+            'partial_index': index,
+            'version': version,
+            'mimetype': 'image/png',
+            'image': image_bytes
+        }, to=[display_room(display) for display in watching])
+        partial_planner.sent(version, len(image_bytes))
+
+    def on_cached(self, run):
+        # Cache hits and deferred reveals go out as an ordinary image change
+        self.announce(run, 'Image loaded from cache' if run.cached else 'New artwork',
+                      cached=run.cached)
+    
+    def on_final(self, run, image_bytes):
+        partial_planner.observe(run.first_partial_seconds, run.seconds, run.partial_count)
+        self.announce(run, 'New artwork', job_id=run.id)
+    
+    def announce(self, run, message, **extra):
+        # Each display gets the URL of the variant rendered for its size
+        for display in self.displays or DISPLAY_NAMES:
+            announce_image(display, message, **extra)
+        broadcast_manifest(self.displays)
+
+class HistorySink(Sink):
+    """Records the archived image in history and puts it on the target displays"""
+    
+    def __init__(self, displays=None):
+        self.displays = displays
+    
+    def on_final(self, run, image_bytes):
+        self.show(run)
+        prewarm_for_displays(run.archive_path)
+    
+    def on_cached(self, run):
+        self.show(run)
+    
+    def show(self, run):
+        # Archives are content-addressed, so identical bytes re-show the
+        # existing entry rather than duplicating it in history
+        image_id = image_id_for_path(run.archive_path)
+        if history.get(image_id):
+            for display in self.displays or DISPLAY_NAMES:
+                history.jump(image_id, display)
+        else:
+            history.add(run.archive_path, prompt=run.prompt, source=run.source,
+                        displays=self.displays)
+
+class DeferredRevealSink(Sink):
+    """Generates quietly and puts the finished image on display at reveal_at"""
+    
+    def __init__(self, reveal_at):
+        self.reveal_at = reveal_at
+    
+    def on_final(self, run, image_bytes):
+        prewarm_for_displays(run.archive_path)
+        self.schedule(run)
+    
+    def on_cached(self, run):
+        self.schedule(run)
+    
+    def schedule(self, run):
+        image_id = image_id_for_path(run.archive_path)
+        schedule_reveal({'id': image_id, 'path': run.archive_path, 'reveal_at': self.reveal_at,
+                         'prompt': run.prompt, 'source': run.source})
+
+def save_pending_reveals():
+    try:
+        atomic_write_json(config.PENDING_REVEALS_FILE, [
+            dict(entry, reveal_at=entry['reveal_at'].isoformat())
+            for entry in list(pending_reveals.values())])
+    except OSError as e:
+        print(f"Could not save pending reveals: {e}")
+
+def schedule_reveal(entry):
+    """Put an archived image on display at entry['reveal_at'] (at once if that's past)"""
+    pending_reveals[entry['id']] = entry
+    save_pending_reveals()
+    broadcast_manifest()
+    delay = max((entry['reveal_at'] - datetime.now()).total_seconds(), 0)
+    timer = threading.Timer(delay, reveal_image, args=(entry,))
+    timer.daemon = True
+    timer.start()
+
+def reveal_image(entry):
+    """Show an already archived image as if it had just been generated"""
+    if pending_reveals.pop(entry['id'], None) is None:
+        return
+    save_pending_reveals()
+    run = GenerationRun(entry.get('prompt'), entry.get('source') or 'weather')
+    run.archive_path = entry['path']
+    for sink in (HistorySink(), BroadcastSink()):
+        sink.on_cached(run)
+
+def restore_pending_reveals():
+    """Re-arm reveals that were still waiting when the server stopped"""
+    if not os.path.exists(config.PENDING_REVEALS_FILE):
+        return
+    try:
+        with open(config.PENDING_REVEALS_FILE, 'r') as f:
+            entries = json.load(f)
+    except (OSError, ValueError) as e:
+        print(f"Could not load pending reveals: {e}")
+        return
+    for entry in entries:
+        if os.path.exists(entry['path']):
+            schedule_reveal(dict(entry, reveal_at=datetime.fromisoformat(entry['reveal_at'])))
+
+def generation_sinks(displays=None):
+    """Sinks for a generation shown on some displays (all of them by default)
+
+    The archive must precede history, and history must precede the
+    preview (which hands the display back to the archived file) and the
+    broadcast so cache hits announce the right image.
+    """
+    return [
+        ArchiveSink(config.IMAGES_DIR),
+        CatalogSink(catalog),
+        HistorySink(displays),
+        PreviewSink(displays),
+        BroadcastSink(displays)
+    ]
+
+def subscribed_displays(displays=None):
+    """Target displays (all for None) with at least one client in their room"""
+    manager = socketio.server.manager
+    return [display for display in displays or DISPLAY_NAMES
+            if next(manager.get_participants('/', display_room(display)), None) is not None]
+
+def plan_partials(job, displays=None):
+    """Partials to request for a job, sized to the displays watching it"""
+    count = partial_planner.choose(subscribed_displays(displays), run_id=job.id)
+    PARTIALS_PLANNED.set(count)
+    return count
+
+def generate_and_broadcast_image(job, force_fresh=False):
+    """Generate image with streaming and broadcast updates to the job's displays"""
+    # The engine enforces timeouts and retries and stops promptly when the
+    # job's cancel event is set; a prompt queued twice hits the cache
+    run_generation(job.prompt, generation_sinks(job.displays), source=job.source,
+                   cancel_event=job.cancel_event, run_id=job.id,
+                   cache=prompt_cache, force_fresh=force_fresh,
+                   partial_images=plan_partials(job, job.displays))
+
+def restore_current_image(displays=None):
+    """Put the current history entries back on display after an aborted generation"""
+    for display in displays or DISPLAY_NAMES:
+        announce_image(display, 'Generation stopped')
+    broadcast_manifest(displays)
+
+def broadcast_job_status(job, message):
+    """Tell the job's displays and every control page about it changing state"""
+    JOB_STATUS.inc(source=job.source, status=job.status)
+    status = {
+        'status': job.status,
+        'job_id': job.id,
+        'source': job.source,
+        'message': message,
+        'queue_depth': generation_queue.depth()
+    }
+    if job.status == 'queued':
+        status['position'] = generation_queue.position(job.id)
+    targets = job.displays or DISPLAY_NAMES
+    if job.status != 'complete':
+        # A client in several of the rooms still gets it once
+        socketio.emit('generation_status', status,
+                      to=[display_room(display) for display in targets] + [CONTROL_ROOM])
+        return
+
+    # Each display hears about its own image; a client following several
+    # gets the first of them, and control pages following none the first target's
+    finished = {}
+    for display in targets:
+        current = history.current(display)
+        finished[display] = dict(status, display=display,
+                                 image_url=f'/current-image?display={display}',
+                                 version=current_image_version(display),
+                                 image_id=current['id'] if current else None)
+    manager = socketio.server.manager
+    reached = []
+    for display in targets:
+        room = display_room(display)
+        socketio.emit('generation_status', finished[display], to=room, skip_sid=reached)
+        reached += [sid for sid, _ in manager.get_participants('/', room)]
+    socketio.emit('generation_status', finished[targets[0]], to=CONTROL_ROOM, skip_sid=reached)
+
+# Bounded priority queue drained by a small worker pool
+generation_queue = JobQueue(max_size=config.GENERATION_QUEUE_SIZE,
+                            workers=config.GENERATION_WORKERS,
+                            on_status=broadcast_job_status)
+
+def build_sync(display=DEFAULT_DISPLAY, client_version=None):
+    """Compact state snapshot for a display that just (re)connected
+
+    Carries the latest partial when a generation is streaming to it,
+    unless the client reports it already shows exactly that version.
+    """
+    current = history.current(display)
+    version = current_image_version(display)
+    running = [job for job in generation_queue.snapshot() if job['status'] == 'running']
+    partial = partial_buffer.latest(display)
+    state = {
+        'display': display,
+        'variant': variant_query(display),
+        'image_id': current['id'] if current else None,
+        'url': image_ref(current, display)['url'] if current else None,
+        'version': version,
+        'up_to_date': client_version is not None and client_version == version,
+        'generation': None,
+        'partial': None
+    }
+    if running:
+        job = running[0]
+        state['generation'] = {
+            'job_id': job['job_id'],
+            'source': job['source'],
+            'prompt': job['prompt'],
+            'partials_received': partial['index'] + 1 if partial and partial['run_id'] == job['job_id'] else 0,
+            'partials_expected': partial_planner.planned(job['job_id'])
+        }
+    if partial and not state['up_to_date']:
+        state['partial'] = {
+            'job_id': partial['run_id'],
+            'partial_index': partial['index'],
+            'version': partial['version'],
+            'mimetype': 'image/png',
+            'image': partial['image'].bytes
+        }
+    return state
+
+def join_display_rooms(displays):
+    """Move the requesting client into the rooms of the given displays (all for None)"""
+    for display in DISPLAY_NAMES:
+        if displays is None or display in displays:
+            join_room(display_room(display))
+        else:
+            leave_room(display_room(display))
 
 @socketio.on('connect')
-def handle_connect():
-    """Handle client connection"""
-    emit('connected', {'message': 'Connected to art display'})
+def handle_connect(auth=None):
+    """Handle client connection
 
-def generate_initial_art():
-    """Generate initial weather-based art on startup"""
-    print("Generating initial weather-based art...")
+    Clients name their display in the connect auth payload and join its
+    room (the default kiosk if they don't). Displays also report the image
+    version they already show, so a reconnect after a Wi-Fi drop downloads
+    nothing when the picture hasn't changed. Control pages connect with
+    role 'control' and may follow every display at once.
+    """
+    auth = auth if isinstance(auth, dict) else {}
     try:
-        from weather_art import generate_weather_art
-        success, message = generate_weather_art()
-        if success:
-            # Add the weather art to history
-            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-            archive_path = os.path.join(config.IMAGES_DIR, f'weather_art_{timestamp}.png')
-            if os.path.exists(current_image_path):
-                shutil.copy2(current_image_path, archive_path)
-                add_to_history(archive_path)
-                save_current_position(0)
-        print(message)
-    except Exception as e:
-        print(f"Could not generate weather art: {e}")
-        print("Placeholder image will be used instead")
+        displays = resolve_displays(auth.get('display'))
+    except ValueError:
+        displays = [DEFAULT_DISPLAY]
+    if displays is None and auth.get('role') != 'control':
+        displays = [DEFAULT_DISPLAY]
+    CONNECTED_CLIENTS.inc()
+    join_display_rooms(displays)
+    if auth.get('role') == 'control':
+        join_room(CONTROL_ROOM)
+    display = (displays or DISPLAY_NAMES)[0]
+    state = build_sync(display, auth.get('version'))
+    if state['up_to_date']:
+        CONNECT_SYNCS.inc(result='up_to_date')
+    else:
+        CONNECT_SYNCS.inc(result='partial' if state['partial'] else 'image')
+    emit('connected', {'message': 'Connected to art display', 'displays': DISPLAY_NAMES})
+    emit('sync', state)
+    emit('manifest', build_manifest(display))
 
-if __name__ == '__main__':
+@socketio.on('select_display')
+@SOCKET_HANDLER_SECONDS.time(event='select_display')
+def handle_select_display(data):
+    """Control pages switch which display (or all of them, with no name) they follow"""
+    try:
+        displays = resolve_displays((data or {}).get('display'))
+    except ValueError as e:
+        emit('display_status', {'status': 'error', 'message': str(e)})
+        return
+    join_display_rooms(displays)
+    emit('display_status', {'status': 'success', 'displays': displays or DISPLAY_NAMES})
+
+@socketio.on('heartbeat')
+def handle_heartbeat(data=None):
+    """Display pages check in periodically; display.py watches for these to stop"""
+    data = data if isinstance(data, dict) else {}
+    display = data.get('display') or DEFAULT_DISPLAY
+    if display not in DISPLAY_NAMES:
+        return
+    client = str(data.get('client') or display)[:64]
+    if client not in heartbeats and len(heartbeats) >= MAX_HEARTBEAT_CLIENTS:
+        # Forget whichever client went quiet first
+        del heartbeats[min(heartbeats, key=lambda name: heartbeats[name]['at'])]
+    heartbeats[client] = {'display': display, 'version': data.get('version'), 'at': time.time()}
+
+@socketio.on('partial_received')
+def handle_partial_received(data=None):
+    """Displays acknowledge each partial, timing its delivery for the planner"""
+    data = data if isinstance(data, dict) else {}
+    display = data.get('display') or DEFAULT_DISPLAY
+    if display in DISPLAY_NAMES and data.get('version'):
+        partial_planner.received(display, str(data['version']))
+
+@socketio.on('disconnect')
+def handle_disconnect(reason=None):
+    """Handle client disconnection"""
+    CONNECTED_CLIENTS.dec()
+
+def generate_weather_job(job, reveal_at=None, force_fresh=False):
+    """Generate weather-based art (runs as a scheduled-priority job)
+    
+    With a future reveal_at the image is generated without previews and
+    swapped onto the display exactly at that time. force_fresh skips the
+    prompt cache, so a refresh doesn't re-show the same picture.
+    """
+    print("Generating weather-based art...")
+    from weather_art import generate_weather_art
+    if reveal_at is not None and reveal_at > datetime.now():
+        sinks = [ArchiveSink(config.IMAGES_DIR), CatalogSink(catalog),
+                 DeferredRevealSink(reveal_at)]
+        # Nothing is previewed, so only the finished image is needed
+        partial_images = partial_planner.minimum
+    else:
+        sinks = generation_sinks()
+        partial_images = plan_partials(job)
+    success, message = generate_weather_art(sinks=sinks,
+                                            cancel_event=job.cancel_event,
+                                            run_id=job.id,
+                                            cache=prompt_cache,
+                                            partial_images=partial_images,
+                                            force_fresh=force_fresh)
+    print(message)
+    if not success:
+        print("Keeping the current image instead")
+        raise RuntimeError(message)
+
+def queue_weather_art(reveal_at=None, force_fresh=False, on_done=None):
+    """Queue weather art behind any user prompts
+
+    on_done(success) is called once the job has finished; a job the user
+    cancelled counts as done.
+    """
+    on_done = on_done or (lambda success: None)
+
+    def task(job):
+        try:
+            generate_weather_job(job, reveal_at=reveal_at, force_fresh=force_fresh)
+        except Exception:
+            on_done(job.cancelled)
+            raise
+        on_done(True)
+
+    try:
+        generation_queue.submit(task, priority=PRIORITY_SCHEDULED, source='weather')
+    except QueueFull:
+        print("Generation queue is full, skipping weather art")
+        on_done(False)
+
+def run_scheduled_rule(rule, target):
+    """Scheduler callback: start weather art early enough to go live at target
+
+    The run only counts as done once the art is made, so a failure (no
+    network yet at boot, say) is retried; periodic refreshes skip the
+    prompt cache.
+    """
+    queue_weather_art(reveal_at=target, force_fresh=rule.every is not None,
+                      on_done=lambda success: scheduler.finished(rule, target, success))
+
+def build_schedule():
+    """Morning weather art plus an optional periodic refresh"""
+    rules = [Rule('morning', at=config.MORNING_GENERATION_TIME,
+                  lead_minutes=config.GENERATION_LEAD_MINUTES)]
+    if config.WEATHER_REFRESH_MINUTES:
+        rules.append(Rule('refresh', every_minutes=config.WEATHER_REFRESH_MINUTES,
+                          lead_minutes=config.GENERATION_LEAD_MINUTES))
+    return Scheduler(rules, config.SCHEDULER_STATE_FILE, run_scheduled_rule,
+                     quiet_hours=config.QUIET_HOURS,
+                     retry_backoff=config.SCHEDULER_RETRY_BACKOFF,
+                     retry_max=config.SCHEDULER_RETRY_MAX)
+
+scheduler = build_schedule()
+
+def protected_image_ids():
+    """Images retention must keep: on display, one step away, or about to be revealed"""
+    ids = set(pending_reveals)
+    for display in DISPLAY_NAMES:
+        for entry in (history.current(display), history.peek(1, display),
+                      history.peek(-1, display)):
+            if entry:
+                ids.add(entry['id'])
+    return ids
+
+def generation_running():
+    return any(job['status'] == 'running' for job in generation_queue.snapshot())
+
+# Keeps the images directory within its budget in the background
+retention = RetentionManager(config.STATE_DB, catalog, history,
+                             max_bytes=config.RETENTION_MAX_BYTES,
+                             max_age_days=config.RETENTION_MAX_AGE_DAYS,
+                             recompress_after_days=config.RETENTION_RECOMPRESS_AFTER_DAYS,
+                             interval=config.RETENTION_INTERVAL,
+                             pause=config.RETENTION_PAUSE,
+                             protected=protected_image_ids,
+                             busy=generation_running,
+                             on_removed=lambda image_ids: broadcast_manifest())
+
+def prewarm_thumbnails():
+    """Render gallery thumbnails for the whole history in the background"""
+    entries, _ = history.page(limit=len(history))
+    for entry in entries:
+        if os.path.exists(entry['path']):
+            derivatives.prewarm(entry['path'], widths=[config.THUMBNAIL_WIDTH])
+
+def startup():
+    """What the server needs before it starts listening
+
+    Only enough to serve the current image; everything else runs in the
+    background once the socket is bound, so the kiosk's readiness probe
+    succeeds as early as possible. The OpenAI client is created on the
+    first generation.
+    """
     ensure_directories()
+    socketio.start_background_task(socket_pulse)
+    socketio.start_background_task(background_startup)
+
+def socket_pulse():
+    """Emit into an empty room on a timer, so /healthz can tell the server is alive"""
+    global last_socket_pulse
+    while True:
+        try:
+            socketio.emit('pulse', {}, to='healthz')
+            last_socket_pulse = time.time()
+        except Exception as e:
+            print(f"Socket.IO pulse failed: {e}")
+        socketio.sleep(config.DISPLAY_HEARTBEAT_SECONDS)
+
+def background_startup():
+    """Startup work that can wait until the display is already being served"""
+    started = time.perf_counter()
+    # Catalog archives from before the catalog existed (first start only)
+    catalog.import_existing(config.IMAGES_DIR, history.page(limit=len(history))[0])
+    prewarm_thumbnails()
     
-    # Try to generate initial art after a short delay
-    # This runs in the background so the server can start immediately
-    threading.Timer(5.0, generate_initial_art).start()
+    # Weather art runs on a schedule; a restart only catches up on a missed
+    # run instead of generating again, and still reveals art it had waiting
+    restore_pending_reveals()
+    scheduler.start()
+    retention.start()
+    print(f"Background startup finished in {time.perf_counter() - started:.2f}s")
+
+if __name__ == '__main__':
+    startup()
     
     # Create SSL context with modern TLS version
     context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
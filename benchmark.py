@@ -0,0 +1,470 @@
+#!/usr/bin/env python3
+"""
+Benchmark suite for the art display
+Starts the server against the fake OpenAI responder in a scratch data
+directory (removed afterwards, kept with the server log if a run fails),
+then measures cold-start time, generation latency, navigation
+round trips and /current-image throughput. Results are written to JSON so runs from
+different commits can be compared.
+
+    python benchmark.py                      # gevent server (serve.py)
+    python benchmark.py --server app         # Werkzeug server (app.py)
+    python benchmark.py --url https://host:8443 --scenarios http
+
+Install websocket-client to measure over WebSocket like the browsers do;
+without it the Socket.IO client falls back to long polling.
+"""
+
+import argparse
+import json
+import logging
+import os
+import platform
+import shutil
+import socket
+import statistics
+import subprocess
+import sys
+import tempfile
+import threading
+import time
+import uuid
+from datetime import datetime
+
+import requests
+import socketio
+import urllib3
+from werkzeug.serving import make_server
+
+from fake_openai import create_app
+
+BASE_DIR = os.path.dirname(os.path.abspath(__file__))
+SCENARIOS = ('startup', 'generation', 'navigation', 'http')
+WAIT_TIMEOUT = 120.0
+
+
+def percentile(values, pct):
+    """Nearest-rank percentile of a list of numbers"""
+    if not values:
+        return None
+    ordered = sorted(values)
+    index = max(0, min(len(ordered) - 1, round(pct / 100 * len(ordered)) - 1))
+    return ordered[index]
+
+
+def summarize(seconds):
+    """Latency summary in milliseconds"""
+    if not seconds:
+        return None
+    ms = [value * 1000 for value in seconds]
+    return {
+        'count': len(ms),
+        'mean': statistics.mean(ms),
+        'min': min(ms),
+        'p50': percentile(ms, 50),
+        'p95': percentile(ms, 95),
+        'p99': percentile(ms, 99),
+        'max': max(ms)
+    }
+
+
+def git_commit():
+    try:
+        return subprocess.run(['git', 'rev-parse', '--short', 'HEAD'], cwd=BASE_DIR,
+                              capture_output=True, text=True, check=True).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def free_port():
+    with socket.socket() as sock:
+        sock.bind(('127.0.0.1', 0))
+        return sock.getsockname()[1]
+
+
+def insecure_session():
+    """requests session for the display's self-signed certificate
+
+    trust_env is off because REQUESTS_CA_BUNDLE would otherwise re-enable
+    verification.
+    """
+    session = requests.Session()
+    session.verify = False
+    session.trust_env = False
+    return session
+
+
+class FakeResponder:
+    """The fake OpenAI server from fake_openai.py, run on a background thread"""
+
+    def __init__(self, partials, width, height, first_delay, partial_delay):
+        fake = create_app(partials, width, height, first_delay, partial_delay, unique=True)
+        logging.getLogger('werkzeug').setLevel(logging.ERROR)
+        self.server = make_server('127.0.0.1', free_port(), fake, threaded=True)
+        self.url = f"http://127.0.0.1:{self.server.server_port}/v1"
+        threading.Thread(target=self.server.serve_forever, daemon=True).start()
+
+    def stop(self):
+        self.server.shutdown()
+
+
+class ServerProcess:
+    """app.py or serve.py in a subprocess with its own data directory and port"""
+
+    def __init__(self, script, openai_url, data_dir=None):
+        self.owns_data_dir = data_dir is None
+        self.data_dir = data_dir or tempfile.mkdtemp(prefix='art-display-bench-')
+        self.port = free_port()
+        self.url = f"https://127.0.0.1:{self.port}"
+
+        # Mark the morning run as done far in the future so the scheduler
+        # doesn't queue weather art in the middle of a measurement
+        with open(os.path.join(self.data_dir, 'scheduler_state.json'), 'w') as f:
+            json.dump({'morning': '2999-01-01T07:00:00'}, f)
+
+        env = dict(os.environ,
+                   ART_DISPLAY_DATA_DIR=self.data_dir,
+                   PORT=str(self.port),
+                   OPENAI_BASE_URL=openai_url,
+                   OPENAI_API_KEY='benchmark')
+        self.log = open(os.path.join(self.data_dir, 'server.log'), 'w')
+        # cwd is the repo so the server finds certs/
+        self.started = time.perf_counter()
+        self.process = subprocess.Popen([sys.executable, script], cwd=BASE_DIR, env=env,
+                                        stdout=self.log, stderr=subprocess.STDOUT)
+
+    def wait_ready(self, timeout=60.0):
+        """Wait for the port to accept connections, then for the first image
+
+        Returns seconds from launch to each, the first being what
+        display.py's readiness probe sees.
+        """
+        session = insecure_session()
+        deadline = time.monotonic() + timeout
+        port_open = None
+        while time.monotonic() < deadline:
+            if self.process.poll() is not None:
+                raise RuntimeError(f"Server exited early, see {self.log.name}")
+            if port_open is None:
+                with socket.socket() as sock:
+                    sock.settimeout(1)
+                    if sock.connect_ex(('127.0.0.1', self.port)) == 0:
+                        port_open = time.perf_counter() - self.started
+                        continue
+            else:
+                try:
+                    if session.get(f"{self.url}/current-image", timeout=5).ok:
+                        return port_open, time.perf_counter() - self.started
+                except requests.RequestException:
+                    pass
+            time.sleep(0.02)
+        raise RuntimeError(f"Server did not start within {timeout:.0f}s, see {self.log.name}")
+
+    def stop(self, keep_data=False):
+        """Stop the server and remove the data directory it created, unless keep_data"""
+        self.process.terminate()
+        try:
+            self.process.wait(timeout=10)
+        except subprocess.TimeoutExpired:
+            self.process.kill()
+        self.log.close()
+        if not self.owns_data_dir:
+            return
+        if keep_data:
+            print(f"Server data and log kept in {self.data_dir}")
+        else:
+            shutil.rmtree(self.data_dir, ignore_errors=True)
+
+
+class DisplayClient:
+    """A Socket.IO client that timestamps every event it receives"""
+
+    def __init__(self, url):
+        self.sio = socketio.Client(http_session=insecure_session(), ssl_verify=False)
+        self.cond = threading.Condition()
+        self.events = []        # (name, data, arrival time)
+
+        @self.sio.on('*')
+        def record(event, data=None):
+            now = time.perf_counter()
+            with self.cond:
+                self.events.append((event, data, now))
+                self.cond.notify_all()
+
+        self.sio.connect(url)
+
+    @property
+    def transport(self):
+        return self.sio.transport()
+
+    def wait_for(self, match, since, timeout=WAIT_TIMEOUT):
+        """Wait for an event received after index `since` that satisfies match(name, data)"""
+        deadline = time.monotonic() + timeout
+        with self.cond:
+            while True:
+                for name, data, arrived in self.events[since:]:
+                    if match(name, data):
+                        return data, arrived
+                remaining = deadline - time.monotonic()
+                if remaining <= 0:
+                    raise TimeoutError('Timed out waiting for a server event')
+                self.cond.wait(remaining)
+
+    def mark(self):
+        with self.cond:
+            return len(self.events)
+
+    def close(self):
+        self.sio.disconnect()
+
+
+def run_startup(script, openai_url, runs):
+    """Cold-start time of fresh server processes, to an open port and a first image
+
+    The first run starts from an empty data directory, like a first boot;
+    the rest reuse it, like a reboot of a frame that's been running a while.
+    """
+    data_dir = tempfile.mkdtemp(prefix='art-display-bench-')
+    timings = []
+    try:
+        for _ in range(runs):
+            server = ServerProcess(script, openai_url, data_dir=data_dir)
+            try:
+                timings.append(server.wait_ready())
+            finally:
+                server.stop()
+    except Exception:
+        print(f"Startup data and log kept in {data_dir}")
+        raise
+    shutil.rmtree(data_dir, ignore_errors=True)
+    first_port, first_image = timings[0]
+    return {
+        'runs': runs,
+        'first_boot': {'port_open_ms': first_port * 1000, 'first_image_ms': first_image * 1000},
+        'port_open_ms': summarize([port for port, _ in timings[1:]]),
+        'first_image_ms': summarize([image for _, image in timings[1:]])
+    }
+
+
+def run_generation(url, runs, listeners):
+    """Emit generate_image and time first partial, last image_update and completion
+
+    The last image_update is the finished image's 'changed' update, taken
+    across the submitting client and every listener, so broadcast fan-out
+    is part of the measurement.
+    """
+    control = DisplayClient(url)
+    displays = [DisplayClient(url) for _ in range(listeners)]
+    first_partial, last_update, complete = [], [], []
+    try:
+        for _ in range(runs):
+            marks = [client.mark() for client in [control] + displays]
+            since = marks[0]
+            started = time.perf_counter()
+            control.sio.emit('generate_image', {'prompt': f"benchmark {uuid.uuid4().hex}",
+                                                'force_fresh': True})
+            submitted, _ = control.wait_for(lambda name, data: name == 'job_submitted', since)
+            job_id = submitted['job_id']
+            _, first = control.wait_for(
+                lambda name, data: name == 'image_update' and data.get('job_id') == job_id, since)
+            _, done = control.wait_for(
+                lambda name, data: (name == 'generation_status' and data.get('job_id') == job_id
+                                    and data['status'] in ('complete', 'error', 'cancelled')),
+                since)
+            arrivals = [client.wait_for(
+                lambda name, data: (name == 'image_update' and data.get('status') == 'changed'
+                                    and data.get('job_id') == job_id), mark)[1]
+                for client, mark in zip([control] + displays, marks)]
+
+            first_partial.append(first - started)
+            last_update.append(max(arrivals) - started)
+            complete.append(done - started)
+        return {
+            'runs': runs,
+            'listeners': listeners,
+            'transport': control.transport,
+            'first_partial_ms': summarize(first_partial),
+            'last_image_update_ms': summarize(last_update),
+            'complete_ms': summarize(complete)
+        }
+    finally:
+        for client in [control] + displays:
+            client.close()
+
+
+def run_navigation(url, iterations):
+    """Round-trip time of previous_image/next_image to their status replies"""
+    client = DisplayClient(url)
+    timings = {'previous_image': [], 'next_image': []}
+    replies = {'previous_image': 'previous_status', 'next_image': 'next_status'}
+    try:
+        for _ in range(iterations):
+            for event in ('previous_image', 'next_image'):
+                since = client.mark()
+                started = time.perf_counter()
+                client.sio.emit(event)
+                _, arrived = client.wait_for(lambda name, data: name == replies[event], since)
+                timings[event].append(arrived - started)
+        return {
+            'iterations': iterations,
+            'transport': client.transport,
+            'previous_image_ms': summarize(timings['previous_image']),
+            'next_image_ms': summarize(timings['next_image'])
+        }
+    finally:
+        client.close()
+
+
+def run_http(url, path, concurrency, duration):
+    """Fetch path from `concurrency` keep-alive clients for `duration` seconds"""
+    latencies = []
+    errors = [0]
+    transferred = [0]
+    lock = threading.Lock()
+    deadline = time.monotonic() + duration
+
+    def client():
+        session = insecure_session()
+        session.headers['Accept'] = 'image/webp,image/*'
+        local, failed, size = [], 0, 0
+        while time.monotonic() < deadline:
+            start = time.perf_counter()
+            try:
+                response = session.get(url + path, timeout=30)
+                response.raise_for_status()
+                size += len(response.content)
+                local.append(time.perf_counter() - start)
+            except requests.RequestException:
+                failed += 1
+        with lock:
+            latencies.extend(local)
+            errors[0] += failed
+            transferred[0] += size
+
+    threads = [threading.Thread(target=client) for _ in range(concurrency)]
+    started = time.monotonic()
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+    elapsed = time.monotonic() - started
+
+    return {
+        'path': path,
+        'concurrency': concurrency,
+        'duration': elapsed,
+        'requests': len(latencies),
+        'errors': errors[0],
+        'requests_per_second': len(latencies) / elapsed,
+        'megabytes_per_second': transferred[0] / elapsed / 1e6,
+        'latency_ms': summarize(latencies)
+    }
+
+
+def print_results(results):
+    startup = results.get('startup')
+    if startup:
+        print(f"startup (first boot): port open {startup['first_boot']['port_open_ms']:.0f} ms, "
+              f"first image {startup['first_boot']['first_image_ms']:.0f} ms")
+        if startup['port_open_ms']:
+            print(f"startup ({startup['runs'] - 1} restarts): "
+                  f"port open p50 {startup['port_open_ms']['p50']:.0f} ms, "
+                  f"first image p50 {startup['first_image_ms']['p50']:.0f} ms")
+    generation = results.get('generation')
+    if generation:
+        print(f"generation ({generation['runs']} runs, {generation['listeners']} listeners, "
+              f"{generation['transport']}): "
+              f"first partial p50 {generation['first_partial_ms']['p50']:.0f} ms, "
+              f"last update p50 {generation['last_image_update_ms']['p50']:.0f} ms, "
+              f"complete p50 {generation['complete_ms']['p50']:.0f} ms")
+    navigation = results.get('navigation')
+    if navigation:
+        print(f"navigation ({navigation['iterations']} round trips): "
+              f"previous p50 {navigation['previous_image_ms']['p50']:.1f} ms, "
+              f"next p50 {navigation['next_image_ms']['p50']:.1f} ms")
+    for run in results.get('http', []):
+        latency = run['latency_ms'] or {}
+        print(f"{run['path']} x{run['concurrency']}: {run['requests_per_second']:.1f} req/s, "
+              f"{run['megabytes_per_second']:.1f} MB/s, p50 {latency.get('p50', 0):.1f} ms, "
+              f"p95 {latency.get('p95', 0):.1f} ms, {run['errors']} errors")
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--server', choices=('serve', 'app'), default='serve',
+                        help='Entry point to start (ignored with --url)')
+    parser.add_argument('--url', help='Benchmark an already running server instead')
+    parser.add_argument('--scenarios', nargs='+', choices=SCENARIOS, default=list(SCENARIOS))
+    parser.add_argument('--startup-runs', type=int, default=5,
+                        help='Server launches for the startup scenario')
+    parser.add_argument('--partials', type=int, default=3, help='Partials per fake generation')
+    parser.add_argument('--width', type=int, default=1536, help='Fake partial width')
+    parser.add_argument('--height', type=int, default=1024, help='Fake partial height')
+    parser.add_argument('--first-delay', type=float, default=0.5)
+    parser.add_argument('--partial-delay', type=float, default=0.5)
+    parser.add_argument('--generations', type=int, default=5)
+    parser.add_argument('--listeners', type=int, default=3,
+                        help='Extra display clients receiving broadcasts')
+    parser.add_argument('--navigations', type=int, default=50)
+    parser.add_argument('--path', default='/current-image', help='Path for the HTTP scenario')
+    parser.add_argument('--concurrency', type=int, nargs='+', default=[1, 10, 100])
+    parser.add_argument('--duration', type=float, default=10.0, help='Seconds per HTTP run')
+    parser.add_argument('--output', default='benchmark_results.json')
+    args = parser.parse_args()
+
+    # The display uses a self-signed certificate
+    urllib3.disable_warnings()
+
+    results = {
+        'commit': git_commit(),
+        'timestamp': datetime.now().isoformat(),
+        'python': platform.python_version(),
+        'machine': platform.machine(),
+        'cpus': os.cpu_count(),
+        'server': args.url or args.server,
+        'params': {
+            'partials': args.partials,
+            'partial_size': f"{args.width}x{args.height}",
+            'first_delay': args.first_delay,
+            'partial_delay': args.partial_delay
+        }
+    }
+    fake, server = None, None
+    url = args.url
+    finished = False
+    try:
+        if url is None:
+            fake = FakeResponder(args.partials, args.width, args.height,
+                                 args.first_delay, args.partial_delay)
+            script = os.path.join(BASE_DIR, f"{args.server}.py")
+            if 'startup' in args.scenarios:
+                # Measured first, with nothing else running
+                results['startup'] = run_startup(script, fake.url, args.startup_runs)
+            server = ServerProcess(script, fake.url)
+            server.wait_ready()
+            url = server.url
+        elif 'startup' in args.scenarios:
+            print("Skipping the startup scenario, it needs to launch the server itself")
+
+        if 'generation' in args.scenarios:
+            results['generation'] = run_generation(url, args.generations, args.listeners)
+        if 'navigation' in args.scenarios:
+            results['navigation'] = run_navigation(url, args.navigations)
+        if 'http' in args.scenarios:
+            results['http'] = [run_http(url, args.path, concurrency, args.duration)
+                               for concurrency in args.concurrency]
+        finished = True
+    finally:
+        if server:
+            server.stop(keep_data=not finished)
+        if fake:
+            fake.stop()
+
+    with open(args.output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print_results(results)
+    print(f"Results written to {args.output}")
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,289 @@
+"""
+Searchable catalog of every archived image
+One row per image file with the prompt, source, weather snapshot,
+dimensions, hash and favorite flag, plus an FTS5 index over prompts.
+Lives in the same SQLite database as the history.
+An archive's ID is the SHA-256 of the bytes it was generated with;
+sha256 is the hash of the file as it is now, which differs once
+retention has losslessly recompressed it.
+"""
+
+import glob
+import hashlib
+import json
+import os
+import re
+import threading
+from datetime import date, datetime, timedelta
+
+from generation import Sink
+from history import image_id_for_path, open_database
+
+try:
+    from PIL import Image
+    PIL_AVAILABLE = True
+except ImportError:
+    PIL_AVAILABLE = False
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS catalog (
+    id TEXT PRIMARY KEY,
+    path TEXT NOT NULL,
+    created TEXT NOT NULL,
+    prompt TEXT,
+    source TEXT,
+    weather TEXT,
+    width INTEGER,
+    height INTEGER,
+    sha256 TEXT,
+    favorite INTEGER NOT NULL DEFAULT 0
+);
+CREATE INDEX IF NOT EXISTS catalog_created ON catalog (created);
+CREATE INDEX IF NOT EXISTS catalog_sha256 ON catalog (sha256);
+CREATE INDEX IF NOT EXISTS catalog_favorites ON catalog (created) WHERE favorite = 1;
+
+CREATE VIRTUAL TABLE IF NOT EXISTS catalog_fts USING fts5(
+    prompt, content='catalog', content_rowid='rowid'
+);
+CREATE TRIGGER IF NOT EXISTS catalog_fts_insert AFTER INSERT ON catalog BEGIN
+    INSERT INTO catalog_fts (rowid, prompt) VALUES (new.rowid, new.prompt);
+END;
+CREATE TRIGGER IF NOT EXISTS catalog_fts_delete AFTER DELETE ON catalog BEGIN
+    INSERT INTO catalog_fts (catalog_fts, rowid, prompt) VALUES ('delete', old.rowid, old.prompt);
+END;
+CREATE TRIGGER IF NOT EXISTS catalog_fts_update AFTER UPDATE OF prompt ON catalog BEGIN
+    INSERT INTO catalog_fts (catalog_fts, rowid, prompt) VALUES ('delete', old.rowid, old.prompt);
+    INSERT INTO catalog_fts (rowid, prompt) VALUES (new.rowid, new.prompt);
+END;
+"""
+
+COLUMNS = ('id', 'path', 'created', 'prompt', 'source', 'weather', 'width', 'height',
+           'sha256', 'favorite')
+SELECT = 'SELECT ' + ', '.join(f'catalog.{name}' for name in COLUMNS) + ' FROM catalog'
+
+# Archives written before images were content-addressed
+LEGACY_NAME = re.compile(r'^(?P<kind>weather_art|art)_(?P<stamp>\d{8}_\d{6})\.png$')
+LEGACY_SOURCES = {'art': 'user', 'weather_art': 'weather'}
+
+
+def file_sha256(path):
+    digest = hashlib.sha256()
+    with open(path, 'rb') as f:
+        for chunk in iter(lambda: f.read(1024 * 1024), b''):
+            digest.update(chunk)
+    return digest.hexdigest()
+
+
+def image_size(path):
+    """(width, height) from the image header, or (None, None)"""
+    if not PIL_AVAILABLE:
+        return None, None
+    try:
+        with Image.open(path) as img:
+            return img.size
+    except OSError:
+        return None, None
+
+
+def fts_query(text):
+    """Turn free text into an FTS5 query matching every word (prefixes too)"""
+    words = re.findall(r'\w+', text.lower())
+    return ' '.join(f'"{word}"*' for word in words)
+
+
+class Catalog:
+    """Image metadata and prompt search"""
+
+    def __init__(self, db_path):
+        self.db_path = db_path
+        self._lock = threading.Lock()
+        self._conn = open_database(db_path)
+        self._conn.executescript(SCHEMA)
+
+    def _row(self, row):
+        if row is None:
+            return None
+        entry = dict(zip(COLUMNS, row))
+        entry['weather'] = json.loads(entry['weather']) if entry['weather'] else None
+        entry['favorite'] = bool(entry['favorite'])
+        return entry
+
+    def _query(self, sql, params=()):
+        with self._lock:
+            return [self._row(row) for row in self._conn.execute(sql, params).fetchall()]
+
+    def __len__(self):
+        with self._lock:
+            return self._conn.execute('SELECT COUNT(*) FROM catalog').fetchone()[0]
+
+    def add(self, path, prompt=None, source=None, weather=None, created=None, sha256=None):
+        """Record an archived image; fills in missing details if it's already known
+
+        Only a new row reads the file for its size and hash; pass sha256
+        when the bytes are at hand to skip hashing the file.
+        """
+        image_id = image_id_for_path(path)
+        weather = json.dumps(weather) if weather else None
+        with self._lock, self._conn:
+            known = self._conn.execute(
+                'UPDATE catalog SET path = ?, '
+                'prompt = COALESCE(prompt, ?), '
+                'source = COALESCE(source, ?), '
+                'weather = COALESCE(weather, ?) '
+                'WHERE id = ?',
+                (path, prompt, source, weather, image_id)).rowcount
+        if known:
+            return image_id
+
+        width, height = image_size(path)
+        sha256 = sha256 or file_sha256(path)
+        created = created or datetime.now().isoformat()
+        with self._lock, self._conn:
+            self._conn.execute(
+                f'INSERT INTO catalog ({", ".join(COLUMNS)}) VALUES (?, ?, ?, ?, ?, ?, ?, ?, ?, 0) '
+                'ON CONFLICT (id) DO UPDATE SET '
+                'path = excluded.path, '
+                'prompt = COALESCE(catalog.prompt, excluded.prompt), '
+                'source = COALESCE(catalog.source, excluded.source), '
+                'weather = COALESCE(catalog.weather, excluded.weather)',
+                (image_id, path, created, prompt, source, weather, width, height, sha256))
+        return image_id
+
+    def get(self, image_id):
+        rows = self._query(f'{SELECT} WHERE id = ?', (image_id,))
+        return rows[0] if rows else None
+
+    def set_favorite(self, image_id, favorite=True):
+        """Mark or unmark a favorite; returns False for unknown images"""
+        with self._lock, self._conn:
+            cursor = self._conn.execute('UPDATE catalog SET favorite = ? WHERE id = ?',
+                                        (1 if favorite else 0, image_id))
+            return cursor.rowcount > 0
+
+    def set_sha256(self, image_id, sha256):
+        """Record the new content hash of a file rewritten in place"""
+        with self._lock, self._conn:
+            self._conn.execute('UPDATE catalog SET sha256 = ? WHERE id = ?', (sha256, image_id))
+
+    def remove(self, image_id):
+        """Forget an image whose file has been deleted"""
+        with self._lock, self._conn:
+            self._conn.execute('DELETE FROM catalog WHERE id = ?', (image_id,))
+
+    def oldest_first(self):
+        """(id, path, created, favorite) of every image, oldest first"""
+        with self._lock:
+            return [(image_id, path, created, bool(favorite)) for image_id, path, created, favorite
+                    in self._conn.execute('SELECT id, path, created, favorite FROM catalog '
+                                          'ORDER BY created')]
+
+    def search(self, text, limit=50):
+        """Images whose prompt matches every word of text, best matches first"""
+        query = fts_query(text)
+        if not query:
+            return []
+        return self._query(
+            f'{SELECT} JOIN catalog_fts ON catalog.rowid = catalog_fts.rowid '
+            'WHERE catalog_fts MATCH ? ORDER BY bm25(catalog_fts) LIMIT ?',
+            (query, limit))
+
+    def favorite_ids(self):
+        """IDs of every favorite (a small set, read through the partial index)"""
+        with self._lock:
+            return {row[0] for row in self._conn.execute('SELECT id FROM catalog WHERE favorite = 1')}
+
+    def favorites(self, limit=50):
+        return self._query(f'{SELECT} WHERE favorite = 1 '
+                           'ORDER BY created DESC LIMIT ?', (limit,))
+
+    def random_favorite(self):
+        """A random favorite, or None (uses the partial favorites index)"""
+        with self._lock:
+            count = self._conn.execute(
+                'SELECT COUNT(*) FROM catalog WHERE favorite = 1').fetchone()[0]
+        if not count:
+            return None
+        offset = int.from_bytes(os.urandom(4), 'big') % count
+        rows = self._query(f'{SELECT} WHERE favorite = 1 '
+                           'ORDER BY created LIMIT 1 OFFSET ?', (offset,))
+        return rows[0] if rows else None
+
+    def same_day_last_year(self, day=None):
+        """Images made on this calendar day one year earlier (Feb 29 maps to Feb 28)"""
+        day = day or date.today()
+        try:
+            last_year = day.replace(year=day.year - 1)
+        except ValueError:
+            last_year = day.replace(year=day.year - 1, day=28)
+        start = last_year.isoformat()
+        end = (last_year + timedelta(days=1)).isoformat()
+        return self._query(f'{SELECT} WHERE created >= ? AND created < ? '
+                           'ORDER BY created', (start, end))
+
+    def import_existing(self, images_dir, history_entries=(), force=False):
+        """One-time ingest of archives already on disk and the history's prompts
+
+        Runs once per database unless forced; images already in the catalog
+        are skipped, so a forced run only picks up what's missing.
+        """
+        with self._lock:
+            done = self._conn.execute(
+                "SELECT value FROM state WHERE key = 'catalog_imported'").fetchone()
+            if done and not force:
+                return 0
+            known = {row[0] for row in self._conn.execute('SELECT id FROM catalog')}
+        imported = 0
+
+        for entry in history_entries:
+            if entry['id'] in known or not os.path.exists(entry['path']):
+                continue
+            if os.path.basename(entry['path']).startswith(('placeholder', 'current', 'partial')):
+                continue
+            self.add(entry['path'], prompt=entry.get('prompt'), source=entry.get('source'),
+                     created=entry.get('timestamp'))
+            known.add(entry['id'])
+            imported += 1
+
+        for path in sorted(glob.glob(os.path.join(images_dir, '*.png'))):
+            image_id = image_id_for_path(path)
+            if image_id in known:
+                continue
+            match = LEGACY_NAME.match(os.path.basename(path))
+            if match:
+                created = datetime.strptime(match['stamp'], '%Y%m%d_%H%M%S').isoformat()
+                source = LEGACY_SOURCES[match['kind']]
+            elif re.fullmatch(r'[0-9a-f]{64}', image_id):
+                created = datetime.fromtimestamp(os.path.getmtime(path)).isoformat()
+                source = None
+            else:
+                continue  # current.png, partials, placeholders
+            self.add(path, source=source, created=created)
+            known.add(image_id)
+            imported += 1
+
+        with self._lock, self._conn:
+            self._conn.execute("INSERT OR REPLACE INTO state (key, value) "
+                               "VALUES ('catalog_imported', ?)", (datetime.now().isoformat(),))
+        if imported:
+            print(f"Catalog imported {imported} existing images")
+        return imported
+
+
+class CatalogSink(Sink):
+    """Records each finished image with its prompt and weather in the catalog"""
+
+    def __init__(self, catalog):
+        self.catalog = catalog
+
+    def on_final(self, run, image_bytes):
+        # The archive holds exactly these bytes, so there's no need to read it back
+        self.record(run, hashlib.sha256(image_bytes).hexdigest())
+
+    def on_cached(self, run):
+        # A cached image is already catalogued, which makes this a cheap update
+        self.record(run)
+
+    def record(self, run, sha256=None):
+        if run.archive_path:
+            self.catalog.add(run.archive_path, prompt=run.prompt, source=run.source,
+                             weather=run.metadata.get('weather'), sha256=sha256)
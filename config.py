@@ -8,6 +8,7 @@ load_dotenv()
 # API Keys
 OPENAI_API_KEY = os.environ.get('OPENAI_API_KEY', 'your-openai-api-key')
 OPENWEATHER_API_KEY = os.environ.get('OPENWEATHER_API_KEY', 'your-weather-api-key')
+OPENAI_BASE_URL = os.environ.get('OPENAI_BASE_URL')  # Point at a local fake server for testing
 
 # NYC Coordinates
 NYC_LAT = 40.7128
@@ -17,18 +18,74 @@ NYC_LON = -74.0060
 DISPLAY_WIDTH = 1920
 DISPLAY_HEIGHT = 1080
 IMAGE_GENERATION_SIZE = "1536x1024"  # OpenAI supports 1024x1024, 1792x1024, or 1024x1792
+# Named frames, each a Socket.IO room with its own image, history position and
+# image size; open https://<host>:8443/?display=<name>. 'default' is the kiosk
+DISPLAYS = {
+    'default': {'width': DISPLAY_WIDTH, 'height': DISPLAY_HEIGHT, 'format': 'webp'},
+}
 
 # Paths
 BASE_DIR = os.path.dirname(os.path.abspath(__file__))
-IMAGES_DIR = os.path.join(BASE_DIR, 'images')
-CURRENT_IMAGE = os.path.join(IMAGES_DIR, 'current.png')
+DATA_DIR = os.environ.get('ART_DISPLAY_DATA_DIR', BASE_DIR)  # Images and state files; the benchmark points this at a temp dir
+IMAGES_DIR = os.path.join(DATA_DIR, 'images')
+
+# History settings
+STATE_DB = os.path.join(DATA_DIR, 'art_display.db')  # SQLite (WAL) database holding the image history
+HISTORY_FLUSH_DELAY = 2.0  # Seconds to batch history changes before writing to disk
 
 # Server settings
 HOST = '0.0.0.0'
-PORT = 8443  # Changed from 443 to avoid permission issues
+PORT = int(os.environ.get('PORT', 8443))  # Changed from 443 to avoid permission issues
 DEBUG = False
+ACCEL_REDIRECT_PREFIX = os.environ.get('ACCEL_REDIRECT_PREFIX')  # e.g. '/_images/' when nginx serves images/ (see README)
 
 # Art generation settings
 MORNING_GENERATION_TIME = "07:00"  # 7 AM
+GENERATION_LEAD_MINUTES = 5  # Start scheduled art this early so it goes live on time
+WEATHER_REFRESH_MINUTES = None  # e.g. 240 to refresh the weather art every four hours
+QUIET_HOURS = ("23:00", "06:00")  # No scheduled generation in this window
+SCHEDULER_STATE_FILE = os.path.join(DATA_DIR, 'scheduler_state.json')
+SCHEDULER_RETRY_BACKOFF = 120  # Seconds before retrying a failed scheduled run; doubles each time
+SCHEDULER_RETRY_MAX = 1800  # Longest wait between retries of a failed scheduled run
+PENDING_REVEALS_FILE = os.path.join(DATA_DIR, 'pending_reveals.json')  # Scheduled art waiting for its reveal time
 DEFAULT_STYLE = "ethereal digital art, cinematic lighting, highly detailed"
-PARTIAL_IMAGES = 3  # Number of partial images to receive during streaming (1-10)
\ No newline at end of file
+PARTIAL_IMAGES = 3  # Partial images to request until display bandwidth has been measured (1-10)
+PARTIAL_IMAGES_RANGE = (1, 10)  # Bounds for the count planned from bandwidth and generation time
+PARTIAL_BUFFER_SIZE = 10  # Partials kept in memory for late joiners; they are never written to disk
+GENERATION_QUEUE_SIZE = 10  # Maximum prompts waiting to be generated
+GENERATION_WORKERS = 1  # Generations run at once; more than one interleaves previews
+GENERATION_FIRST_PARTIAL_TIMEOUT = 90.0  # Seconds to wait for the first partial image
+GENERATION_TOTAL_TIMEOUT = 300.0  # Seconds before a whole generation is abandoned
+GENERATION_MAX_RETRIES = 2  # Retries for connection errors and early stalls
+GENERATION_RETRY_BACKOFF = 2.0  # Base seconds for jittered exponential backoff
+PROMPT_CACHE_FILE = os.path.join(DATA_DIR, 'prompt_cache.json')
+PROMPT_CACHE_TTL = 7 * 24 * 3600  # Seconds a prompt's image is reused before regenerating
+
+# Derivative (resized variant) cache settings
+DERIVATIVE_CACHE_DIR = os.path.join(IMAGES_DIR, 'cache')
+DERIVATIVE_CACHE_MAX_BYTES = 200 * 1024 * 1024  # LRU eviction once the cache exceeds this
+DERIVATIVE_WIDTHS = (320, 640, 1024)  # Requested widths snap up to one of these
+DERIVATIVE_FORMATS = ('webp', 'avif', 'jpeg')  # Preference order when negotiating from Accept
+DERIVATIVE_QUALITY = 85
+DERIVATIVE_WORKERS = 1  # Background threads for prerendering after generation
+THUMBNAIL_WIDTH = 320  # Width of gallery thumbnails on the control page
+
+# Kiosk supervision (display.py)
+DISPLAY_HEARTBEAT_SECONDS = 10  # How often display pages report that they're alive
+KIOSK_CLIENT = 'kiosk'  # Name the kiosk's page reports its heartbeats under
+KIOSK_HEARTBEAT_TIMEOUT = 60  # Seconds without a heartbeat before Chromium is restarted
+KIOSK_STARTUP_GRACE = 90  # Seconds a freshly launched Chromium gets to send its first heartbeat
+KIOSK_POLL_SECONDS = 15  # How often display.py checks /healthz once the kiosk is up
+KIOSK_STATS_FILE = os.path.join(DATA_DIR, 'kiosk_stats.json')
+
+# Storage retention (favorites and the image on display are never deleted)
+RETENTION_MAX_BYTES = 4 * 1024 * 1024 * 1024  # Oldest archives are deleted once the archive exceeds this
+RETENTION_MAX_AGE_DAYS = None  # e.g. 365 to delete archives older than a year regardless of space
+RETENTION_RECOMPRESS_AFTER_DAYS = 3  # Losslessly re-encode archives older than this (None to disable)
+RETENTION_INTERVAL = 6 * 3600  # Seconds between retention passes
+RETENTION_PAUSE = 1.0  # Seconds to rest between recompressed files so the Pi stays responsive
+
+# Weather settings
+WEATHER_CACHE_FILE = os.path.join(DATA_DIR, 'weather_cache.json')
+WEATHER_CACHE_TTL = 3600  # Seconds before the forecast is fetched again
+WEATHER_PROMPT_MEMO_SIZE = 50  # Weather-to-prompt results remembered
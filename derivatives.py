@@ -0,0 +1,222 @@
+"""
+Resized and recompressed variants of archived art
+Variants are keyed on the source image, width and format, stored on disk
+and evicted least-recently-used once the cache grows past its byte budget
+"""
+
+import hashlib
+import os
+import re
+import threading
+from collections import OrderedDict
+from concurrent.futures import Future, ThreadPoolExecutor
+
+try:
+    from PIL import Image
+    PIL_AVAILABLE = True
+except ImportError:
+    PIL_AVAILABLE = False
+
+# Pillow format name, file extension and mimetype for each supported format
+FORMATS = {
+    'webp': ('WEBP', 'webp', 'image/webp'),
+    'avif': ('AVIF', 'avif', 'image/avif'),
+    'jpeg': ('JPEG', 'jpg', 'image/jpeg'),
+    'png': ('PNG', 'png', 'image/png'),
+}
+
+
+def run_blocking(func, *args):
+    """Run CPU-bound work on a native thread when serving under gevent
+
+    Greenlets share one OS thread, so a long Pillow encode there would stall
+    every connection. Without gevent this is a plain call.
+    """
+    try:
+        from gevent import monkey, get_hub
+    except ImportError:
+        return func(*args)
+    if not monkey.is_module_patched('threading'):
+        return func(*args)
+    return get_hub().threadpool.apply(func, args)
+
+
+CONTENT_ADDRESSED = re.compile(r'[0-9a-f]{64}')
+
+
+def source_key(path):
+    """Cache key of a source image, without reading it
+
+    Archives are named after the SHA-256 of the bytes they were saved with,
+    and their pixels never change under that name (recompression is
+    lossless), so the name is the key. Legacy names and placeholders are
+    keyed on path, mtime and size instead.
+    """
+    name = os.path.splitext(os.path.basename(path))[0]
+    if CONTENT_ADDRESSED.fullmatch(name):
+        return name
+    stat = os.stat(path)
+    return hashlib.sha256(f'{path}:{stat.st_mtime_ns}:{stat.st_size}'.encode()).hexdigest()
+
+
+class DerivativeCache:
+    """On-disk LRU cache of display-sized image variants"""
+
+    def __init__(self, cache_dir, max_bytes, widths, formats, quality=85, workers=1):
+        self.cache_dir = cache_dir
+        self.max_bytes = max_bytes
+        self.widths = sorted(widths)
+        self._wanted_formats = formats
+        self._formats = None
+        self.quality = quality
+
+        self._lock = threading.Lock()
+        self._entries = OrderedDict()  # variant path -> size, oldest first
+        self._total_bytes = 0
+        self._pending = {}          # variant path -> Future
+        self._executor = ThreadPoolExecutor(max_workers=workers,
+                                            thread_name_prefix='derivatives')
+
+        os.makedirs(cache_dir, exist_ok=True)
+        self._scan()
+
+    @property
+    def formats(self):
+        """Configured formats this Pillow build can write
+
+        Probing loads every Pillow plugin, so it waits until first use
+        rather than slowing down startup.
+        """
+        if self._formats is None:
+            self._formats = [fmt for fmt in self._wanted_formats if self._format_supported(fmt)]
+        return self._formats
+
+    @staticmethod
+    def _format_supported(fmt):
+        if fmt not in FORMATS or not PIL_AVAILABLE:
+            return False
+        Image.init()
+        return FORMATS[fmt][0] in Image.SAVE
+
+    def _scan(self):
+        """Rebuild the LRU order from files already on disk"""
+        files = []
+        for name in os.listdir(self.cache_dir):
+            path = os.path.join(self.cache_dir, name)
+            stat = os.stat(path)
+            if name.endswith('.tmp') or stat.st_size == 0:
+                # Left behind by a crash mid-render
+                os.remove(path)
+                continue
+            files.append((stat.st_mtime, path, stat.st_size))
+        for _, path, size in sorted(files):
+            self._entries[path] = size
+            self._total_bytes += size
+
+    def snap_width(self, width):
+        """Round a requested width up to one of the configured sizes
+
+        Returns None (full size) for missing widths or ones above the largest size.
+        """
+        if not width:
+            return None
+        for allowed in self.widths:
+            if width <= allowed:
+                return allowed
+        return None
+
+    def negotiate_format(self, accept_header, requested=None):
+        """Pick an output format from an explicit request or the Accept header"""
+        if requested:
+            return requested if requested in self.formats else None
+        accept = accept_header or ''
+        for fmt in self.formats:
+            if FORMATS[fmt][2] in accept:
+                return fmt
+        return 'jpeg' if 'jpeg' in self.formats else None
+
+    @staticmethod
+    def mimetype(fmt):
+        return FORMATS[fmt][2]
+
+    def variant_path(self, source_path, width, fmt):
+        digest = source_key(source_path)
+        size_tag = f"w{width}" if width else "full"
+        return os.path.join(self.cache_dir, f"{digest[:32]}_{size_tag}.{FORMATS[fmt][1]}")
+
+    def get(self, source_path, width, fmt):
+        """Return the path of a variant, rendering it now if it isn't cached
+
+        Falls back to the source file when Pillow or the format is unavailable.
+        """
+        if not PIL_AVAILABLE or fmt not in self.formats:
+            return source_path
+        path = self.variant_path(source_path, width, fmt)
+        with self._lock:
+            if path in self._entries:
+                self._entries.move_to_end(path)
+                return path
+            future = self._pending.get(path)
+            owner = future is None
+            if owner:
+                # First caller renders; concurrent callers wait on its result
+                future = Future()
+                self._pending[path] = future
+        if owner:
+            try:
+                future.set_result(self._render(source_path, path, width, fmt))
+            except Exception as e:
+                future.set_exception(e)
+        return future.result()
+
+    def prewarm(self, source_path, widths=None, formats=None):
+        """Render variants in the background right after an image is archived"""
+        if not PIL_AVAILABLE:
+            return
+        # None renders a full-size recompressed copy for the display itself
+        for fmt in formats or self.formats[:1]:
+            for width in widths or [None] + self.widths:
+                self._executor.submit(self._prewarm_one, source_path, width, fmt)
+
+    def _prewarm_one(self, source_path, width, fmt):
+        try:
+            self.get(source_path, width, fmt)
+        except Exception as e:
+            print(f"Could not prerender {source_path} at {width}px {fmt}: {e}")
+
+    def _render(self, source_path, path, width, fmt):
+        """Resize, encode and atomically store one variant"""
+        try:
+            tmp_path = f"{path}.tmp"
+            run_blocking(self._encode, source_path, tmp_path, width, fmt)
+            os.replace(tmp_path, path)
+            size = os.path.getsize(path)
+            with self._lock:
+                self._entries[path] = size
+                self._total_bytes += size
+                self._evict()
+            return path
+        finally:
+            with self._lock:
+                self._pending.pop(path, None)
+
+    def _encode(self, source_path, tmp_path, width, fmt):
+        """Pure Pillow work, safe to run off the event loop (touches no locks)"""
+        with Image.open(source_path) as img:
+            if width and img.width > width:
+                height = round(img.height * width / img.width)
+                img = img.resize((width, height), Image.LANCZOS, reducing_gap=2.0)
+            if fmt == 'jpeg' and img.mode != 'RGB':
+                img = img.convert('RGB')
+            img.save(tmp_path, FORMATS[fmt][0], quality=self.quality)
+
+    def _evict(self):
+        """Drop least-recently-used variants until under budget (caller holds the lock)"""
+        while self._total_bytes > self.max_bytes and len(self._entries) > 1:
+            path, size = self._entries.popitem(last=False)
+            self._total_bytes -= size
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+
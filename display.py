@@ -1,89 +1,276 @@
 #!/usr/bin/env python3
 """
 Fullscreen display manager for the art frame
-Runs a chromium browser in kiosk mode
+Runs a chromium browser in kiosk mode and supervises it: waits for the
+server's /healthz readiness probe with exponential backoff, then restarts
+the browser if it exits or its page stops sending heartbeats. Restarts
+and probe latencies are recorded in config.KIOSK_STATS_FILE.
+A server restart between two polls shows up as /healthz reporting a lower
+uptime, and gives the page a fresh grace period to reconnect.
 """
 
+import json
+import ssl
 import subprocess
 import time
 import os
 import sys
+import urllib.error
+import urllib.request
+from datetime import datetime
+
+import config
+from storage import atomic_write_json
+
+SERVER_URL = f'https://localhost:{config.PORT}'
+KIOSK_URL = f'{SERVER_URL}/?client={config.KIOSK_CLIENT}'
+
+# The server uses a self-signed certificate
+SSL_CONTEXT = ssl.create_default_context()
+SSL_CONTEXT.check_hostname = False
+SSL_CONTEXT.verify_mode = ssl.CERT_NONE
+
+LATENCY_SAMPLES = 100  # Recent /healthz latencies kept for the stats file
+MAX_RESTART_BACKOFF = 300  # Upper bound in seconds on the wait between repeated restarts
+STATS_SAVE_SECONDS = 300  # Latency-only stats updates are written at most this often
 
 def kill_existing_browsers():
     """Kill any existing browser instances"""
     subprocess.run(['pkill', '-f', 'chromium'], capture_output=True)
     time.sleep(2)
 
-def wait_for_server():
-    """Wait for the web server to be ready"""
-    import socket
-    retries = 30
-    while retries > 0:
+def check_health(timeout=2.0):
+    """Probe /healthz; returns (status dict or None if unreachable, latency in seconds)"""
+    started = time.monotonic()
+    try:
+        with urllib.request.urlopen(f'{SERVER_URL}/healthz', timeout=timeout,
+                                    context=SSL_CONTEXT) as response:
+            body = response.read()
+    except urllib.error.HTTPError as e:
+        body = e.read()  # 503 while not ready still carries the status
+    except (OSError, ValueError):
+        return None, time.monotonic() - started
+    latency = time.monotonic() - started
+    try:
+        return json.loads(body), latency
+    except ValueError:
+        return None, latency
+
+class Supervisor:
+    """Keeps one kiosk Chromium running and tracks how it's doing"""
+
+    def __init__(self, stats_file=config.KIOSK_STATS_FILE):
+        self.stats_file = stats_file
+        self.browser = None
+        self.launched_at = None
+        self.grace_from = None  # The page gets KIOSK_STARTUP_GRACE from here to check in
+        self.healthy_since = None
+        self.restart_backoff = 0
+        self.server_uptime = None  # Uptime /healthz reported last time
+        self.stats_saved_at = None
+        self.latencies = []
+        self.stats = {
+            'started': datetime.now().isoformat(),
+            'restarts': 0,
+            'restart_reasons': {},
+            'last_restart': None,
+            'server_outages': 0,
+            'server_restarts': 0,
+            'server_wait_seconds': None,
+            'first_heartbeat_seconds': None,
+            'health_latency_ms': {}
+        }
+
+    def record_latency(self, latency):
+        self.latencies = (self.latencies + [latency * 1000])[-LATENCY_SAMPLES:]
+        ordered = sorted(self.latencies)
+        self.stats['health_latency_ms'] = {
+            'p50': round(ordered[len(ordered) // 2], 1),
+            'p95': round(ordered[int(len(ordered) * 0.95)], 1),
+            'max': round(ordered[-1], 1),
+            'samples': len(ordered)
+        }
+
+    def save_stats(self):
+        self.stats_saved_at = time.monotonic()
         try:
-            sock = socket.socket(socket.AF_INET, socket.SOCK_STREAM)
-            sock.settimeout(1)
-            result = sock.connect_ex(('localhost', 8443))
-            sock.close()
-            if result == 0:
-                print("Server is ready!")
-                return True
-        except:
-            pass
-        retries -= 1
-        print(f"Waiting for server... ({retries} retries left)")
-        time.sleep(2)
-    return False
+            atomic_write_json(self.stats_file, self.stats, durable=False)
+        except OSError as e:
+            print(f"Could not save kiosk stats: {e}")
+
+    def server_restarted(self, health):
+        """True if the server reports a lower uptime than last time, i.e. it's a new process"""
+        uptime = health.get('uptime')
+        restarted = (uptime is not None and self.server_uptime is not None
+                     and uptime < self.server_uptime)
+        self.server_uptime = uptime
+        return restarted
+
+    def wait_for_server(self, max_wait=300):
+        """Poll /healthz until the server is ready, backing off from 0.1s to 5s"""
+        started = time.monotonic()
+        delay = 0.1
+        while time.monotonic() - started < max_wait:
+            health, latency = check_health()
+            if health is not None:
+                self.record_latency(latency)
+                self.server_uptime = health.get('uptime')
+                if health.get('ready'):
+                    waited = time.monotonic() - started
+                    self.stats['server_wait_seconds'] = round(waited, 2)
+                    print(f"Server is ready after {waited:.1f}s")
+                    return True
+            print(f"Waiting for server... (retrying in {delay:.1f}s)")
+            time.sleep(delay)
+            delay = min(delay * 2, 5.0)
+        return False
+
+    def launch(self):
+        """Start chromium in kiosk mode with all necessary flags"""
+        cmd = [
+            'chromium-browser',
+            '--kiosk',
+            '--noerrdialogs',
+            '--disable-infobars',
+            '--disable-session-crashed-bubble',
+            '--disable-component-update',
+            '--autoplay-policy=no-user-gesture-required',
+            '--check-for-update-interval=31536000',
+            '--ignore-certificate-errors',
+            '--ignore-certificate-errors-spki-list',
+            '--ignore-ssl-errors',
+            '--allow-insecure-localhost',
+            '--disable-web-security',
+            '--disable-features=TranslateUI',
+            '--disable-features=Translate',
+            '--disable-features=ChromeWhatsNewUI',
+            '--disable-gpu-sandbox',
+            '--disable-software-rasterizer',
+            '--disable-dev-shm-usage',
+            '--disable-setuid-sandbox',
+            '--no-sandbox',
+            '--user-data-dir=/tmp/chromium_art_display',
+            '--disable-background-timer-throttling',
+            '--disable-backgrounding-occluded-windows',
+            '--disable-renderer-backgrounding',
+            KIOSK_URL
+        ]
+
+        # Set environment and start
+        env = os.environ.copy()
+        env['DISPLAY'] = ':0'
+
+        self.browser = subprocess.Popen(cmd, env=env)
+        self.launched_at = time.time()
+        self.grace_from = self.launched_at
+        self.healthy_since = None
+        print("Chromium started successfully!")
+
+    def restart(self, reason):
+        """Kill and relaunch the browser, backing off if it keeps failing"""
+        print(f"Restarting Chromium: {reason}")
+        self.stats['restarts'] += 1
+        reasons = self.stats['restart_reasons']
+        reasons[reason] = reasons.get(reason, 0) + 1
+        self.stats['last_restart'] = {'at': datetime.now().isoformat(), 'reason': reason}
+        self.save_stats()
+
+        if self.browser and self.browser.poll() is None:
+            self.browser.terminate()
+            try:
+                self.browser.wait(timeout=10)
+            except subprocess.TimeoutExpired:
+                self.browser.kill()
+        kill_existing_browsers()
+
+        if self.restart_backoff:
+            print(f"Waiting {self.restart_backoff}s before relaunching")
+            time.sleep(self.restart_backoff)
+        self.restart_backoff = min(max(self.restart_backoff * 2, 5), MAX_RESTART_BACKOFF)
+        self.launch()
+
+    def kiosk_heartbeat(self, health):
+        """Time of the kiosk page's last heartbeat, or None"""
+        beat = (health.get('heartbeats') or {}).get(config.KIOSK_CLIENT)
+        return time.time() - beat['age'] if beat else None
+
+    def check(self):
+        """One supervision pass; returns seconds until the next one"""
+        if self.browser.poll() is not None:
+            print(f"Chromium exited with code {self.browser.returncode}")
+            self.restart('exited')
+            return 1
+
+        health, latency = check_health()
+        if health is None:
+            # The page reconnects by itself once the server is back
+            self.stats['server_outages'] += 1
+            self.save_stats()
+            print("Server unreachable, waiting for it to come back")
+            if self.wait_for_server():
+                # A restarted server has no heartbeats yet; give the page
+                # time to reconnect before judging it
+                self.grace_from = time.time()
+            return 1
+        self.record_latency(latency)
+        if self.server_restarted(health):
+            # Restarted within one poll interval, so it was never seen down
+            self.stats['server_restarts'] += 1
+            self.save_stats()
+            print("Server restarted since the last check, waiting for the page to reconnect")
+            self.grace_from = time.time()
+
+        now = time.time()
+        last_beat = self.kiosk_heartbeat(health)
+        starting = self.healthy_since is None
+        in_grace = now - self.grace_from <= config.KIOSK_STARTUP_GRACE
+        if last_beat is not None and last_beat >= self.launched_at:
+            if starting:
+                first = last_beat - self.launched_at
+                self.stats['first_heartbeat_seconds'] = round(first, 2)
+                print(f"Kiosk page alive {first:.1f}s after launch")
+            stale = now - last_beat > config.KIOSK_HEARTBEAT_TIMEOUT
+            if not stale:
+                self.healthy_since = self.healthy_since or now
+                # A browser that's stayed up a while has earned a fresh backoff
+                if now - self.healthy_since > MAX_RESTART_BACKOFF:
+                    self.restart_backoff = 0
+                # Counters are saved as they change; latencies only now and then
+                if (starting or self.stats_saved_at is None
+                        or time.monotonic() - self.stats_saved_at >= STATS_SAVE_SECONDS):
+                    self.save_stats()
+                return config.KIOSK_POLL_SECONDS
+            if not in_grace:
+                self.restart('heartbeat stale')
+            return 1
+
+        if not in_grace:
+            self.restart('no heartbeat')
+            return 1
+        # Still starting up or reconnecting: look again soon
+        return 1
+
+    def run(self):
+        kill_existing_browsers()
+
+        # Wait for server to be ready
+        if not self.wait_for_server():
+            print("Server failed to start!")
+            sys.exit(1)
+
+        # Disable screen blanking
+        subprocess.run(['xset', 's', 'off'], capture_output=True)
+        subprocess.run(['xset', '-dpms'], capture_output=True)
+        subprocess.run(['xset', 's', 'noblank'], capture_output=True)
+
+        self.launch()
+        self.save_stats()
+        while True:
+            time.sleep(self.check())
 
 def start_display():
-    """Start the display in fullscreen kiosk mode"""
-    kill_existing_browsers()
-    
-    # Wait for server to be ready
-    if not wait_for_server():
-        print("Server failed to start!")
-        sys.exit(1)
-    
-    # Disable screen blanking
-    subprocess.run(['xset', 's', 'off'], capture_output=True)
-    subprocess.run(['xset', '-dpms'], capture_output=True)
-    subprocess.run(['xset', 's', 'noblank'], capture_output=True)
-    
-    # Start chromium in kiosk mode with all necessary flags
-    cmd = [
-        'chromium-browser',
-        '--kiosk',
-        '--noerrdialogs',
-        '--disable-infobars',
-        '--disable-session-crashed-bubble',
-        '--disable-component-update',
-        '--autoplay-policy=no-user-gesture-required',
-        '--check-for-update-interval=31536000',
-        '--ignore-certificate-errors',
-        '--ignore-certificate-errors-spki-list',
-        '--ignore-ssl-errors',
-        '--allow-insecure-localhost',
-        '--disable-web-security',
-        '--disable-features=TranslateUI',
-        '--disable-features=Translate',
-        '--disable-features=ChromeWhatsNewUI',
-        '--disable-gpu-sandbox',
-        '--disable-software-rasterizer',
-        '--disable-dev-shm-usage',
-        '--disable-setuid-sandbox',
-        '--no-sandbox',
-        '--user-data-dir=/tmp/chromium_art_display',
-        '--disable-background-timer-throttling',
-        '--disable-backgrounding-occluded-windows',
-        '--disable-renderer-backgrounding',
-        'https://localhost:8443/'
-    ]
-    
-    # Set environment and start
-    env = os.environ.copy()
-    env['DISPLAY'] = ':0'
-    
-    subprocess.Popen(cmd, env=env)
-    print("Chromium started successfully!")
+    """Start the display in fullscreen kiosk mode and keep it running"""
+    Supervisor().run()
 
 if __name__ == "__main__":
-    start_display()
\ No newline at end of file
+    start_display()
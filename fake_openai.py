@@ -0,0 +1,137 @@
+#!/usr/bin/env python3
+"""
+Fake OpenAI server for local testing
+Streams partial images over Server-Sent Events the way the Responses API does,
+then the finished image in the completed image_generation_call item.
+Point the app at it with OPENAI_BASE_URL=http://localhost:8765/v1
+"""
+
+import argparse
+import base64
+import io
+import itertools
+import json
+import os
+import struct
+import time
+import zlib
+
+from flask import Flask, Response, jsonify, request
+
+try:
+    from PIL import Image
+    PIL_AVAILABLE = True
+except ImportError:
+    PIL_AVAILABLE = False
+
+
+def make_png(width, height):
+    """Noise PNG roughly the size of a real generation"""
+    if not PIL_AVAILABLE:
+        return os.urandom(width * height)
+    img = Image.frombytes('RGB', (width, height), os.urandom(width * height * 3))
+    buffer = io.BytesIO()
+    img.save(buffer, 'PNG', compress_level=1)
+    return buffer.getvalue()
+
+
+def tag_png(png_bytes, tag):
+    """Copy of a PNG with a text chunk added, so every response hashes differently"""
+    data = b'fake\x00' + tag.encode()
+    chunk = struct.pack('>I', len(data)) + b'tEXt' + data
+    chunk += struct.pack('>I', zlib.crc32(b'tEXt' + data))
+    # The last 12 bytes are the IEND chunk
+    return png_bytes[:-12] + chunk + png_bytes[-12:]
+
+
+def create_app(partials=3, width=1536, height=1024, first_delay=1.0, partial_delay=1.0,
+               stall=False, unique=False):
+    """Build the fake server; every request streams the partial_images it
+    asks for (or `partials` images when it doesn't say)
+
+    With unique=True each response's images are tagged with a counter, so
+    archives and caches treat every generation as new.
+    """
+    app = Flask(__name__)
+    # One PNG per partial plus the finished image
+    pngs = [make_png(width, height) for _ in range(partials + 1)]
+    shared = [base64.b64encode(png).decode() for png in pngs]
+    counter = itertools.count()
+
+    @app.route('/v1/responses', methods=['POST'])
+    def responses():
+        if unique:
+            tag = str(next(counter))
+            images = [base64.b64encode(tag_png(png, tag)).decode() for png in pngs]
+        else:
+            images = shared
+        tools = (request.get_json(silent=True) or {}).get('tools') or [{}]
+        count = tools[0].get('partial_images') or partials
+        previews = [images[idx % (len(images) - 1)] for idx in range(count)]
+
+        def stream():
+            time.sleep(first_delay)
+            if stall:
+                # Hold the connection open without sending anything
+                time.sleep(3600)
+            for idx, image_b64 in enumerate(previews):
+                if idx:
+                    time.sleep(partial_delay)
+                event = {
+                    'type': 'response.image_generation_call.partial_image',
+                    'item_id': 'ig_fake',
+                    'output_index': 0,
+                    'sequence_number': idx,
+                    'partial_image_index': idx,
+                    'partial_image_b64': image_b64
+                }
+                yield f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+            time.sleep(partial_delay)
+            event = {
+                'type': 'response.output_item.done',
+                'output_index': 0,
+                'sequence_number': len(previews),
+                'item': {
+                    'type': 'image_generation_call',
+                    'id': 'ig_fake',
+                    'status': 'completed',
+                    'result': images[-1]
+                }
+            }
+            yield f"event: {event['type']}\ndata: {json.dumps(event)}\n\n"
+            yield "data: [DONE]\n\n"
+
+        return Response(stream(), mimetype='text/event-stream')
+
+    @app.route('/v1/chat/completions', methods=['POST'])
+    def chat_completions():
+        return jsonify({
+            'id': 'chatcmpl-fake',
+            'object': 'chat.completion',
+            'created': int(time.time()),
+            'model': 'gpt-4.1',
+            'choices': [{
+                'index': 0,
+                'finish_reason': 'stop',
+                'message': {'role': 'assistant', 'content': 'soft grey fog over a quiet city'}
+            }]
+        })
+
+    return app
+
+
+if __name__ == '__main__':
+    parser = argparse.ArgumentParser(description=__doc__)
+    parser.add_argument('--port', type=int, default=8765)
+    parser.add_argument('--partials', type=int, default=3)
+    parser.add_argument('--width', type=int, default=1536)
+    parser.add_argument('--height', type=int, default=1024)
+    parser.add_argument('--first-delay', type=float, default=1.0)
+    parser.add_argument('--partial-delay', type=float, default=1.0)
+    parser.add_argument('--stall', action='store_true', help='never send any partials')
+    parser.add_argument('--unique', action='store_true', help='make every response a new image')
+    args = parser.parse_args()
+
+    fake = create_app(args.partials, args.width, args.height,
+                      args.first_delay, args.partial_delay, args.stall, args.unique)
+    fake.run(host='127.0.0.1', port=args.port, threaded=True)
@@ -0,0 +1,358 @@
+"""
+Async streaming image generation engine
+Runs the OpenAI streaming call on a dedicated asyncio loop with per-stage
+timeouts, cooperative cancellation and jittered retries on transient errors.
+Every caller (socket handler, startup, scheduler) goes through run_generation,
+which hands each partial to a list of sinks still base64-encoded; it is
+decoded at most once, and only if a sink needs the bytes.
+The openai package is slow to import, so it's only loaded once the engine
+first talks to the API.
+"""
+
+import asyncio
+import concurrent.futures
+import hashlib
+import os
+import random
+import threading
+import time
+import uuid
+
+import config
+from metrics import Counter, Histogram
+from partials import PartialImage
+from storage import atomic_write_bytes
+
+PARTIAL_IMAGE_EVENT = "response.image_generation_call.partial_image"
+OUTPUT_ITEM_DONE_EVENT = "response.output_item.done"
+
+
+def transient_errors():
+    """Errors worth retrying; anything else (bad prompt, auth, moderation) is final"""
+    from openai import APIConnectionError, APITimeoutError, InternalServerError, RateLimitError
+    return (APIConnectionError, APITimeoutError, InternalServerError, RateLimitError)
+
+GENERATIONS = Counter('art_generations', 'Generations by source and outcome',
+                      ['source', 'outcome'])
+GENERATION_RETRIES = Counter('art_generation_retries', 'Retried generation attempts')
+GENERATION_SECONDS = Histogram('art_generation_seconds', 'Whole generation, API call to final sink',
+                               ['source'])
+FIRST_PARTIAL_SECONDS = Histogram('art_generation_first_partial_seconds',
+                                  'Time from starting a generation to its first partial image')
+SINK_SECONDS = Histogram('art_sink_seconds', 'Time spent in each sink hook',
+                         ['sink', 'hook'])
+
+
+class GenerationTimeout(Exception):
+    """Raised when a stage of the stream takes longer than allowed"""
+
+    def __init__(self, message, stage):
+        super().__init__(message)
+        self.stage = stage
+
+
+class GenerationCancelled(Exception):
+    """Raised when a generation is cancelled by the user"""
+
+
+def image_generation_tool(partial_images=None):
+    """Image generation tool parameters for the Responses API"""
+    return {
+        "type": "image_generation",
+        "partial_images": partial_images or config.PARTIAL_IMAGES,
+        "quality": "high",
+        "moderation": "low",
+        "size": config.IMAGE_GENERATION_SIZE
+    }
+
+
+class GenerationEngine:
+    """Streams image generations on a background event loop
+
+    generate() is called from ordinary (worker) threads and blocks until the
+    final image arrives, the job is cancelled, or a timeout fires.
+    """
+
+    def __init__(self, api_key, base_url=None, first_partial_timeout=90.0,
+                 total_timeout=300.0, max_retries=2, retry_backoff=2.0):
+        self.api_key = api_key
+        self.base_url = base_url
+        self.first_partial_timeout = first_partial_timeout
+        self.total_timeout = total_timeout
+        self.max_retries = max_retries
+        self.retry_backoff = retry_backoff
+
+        self._client = None
+        self._loop = asyncio.new_event_loop()
+        self._thread = threading.Thread(target=self._loop.run_forever,
+                                        name='generation-loop', daemon=True)
+        self._thread.start()
+
+    def _get_client(self):
+        """Create the async client on the engine loop the first time it's needed"""
+        if self._client is None:
+            from openai import AsyncOpenAI
+            self._client = AsyncOpenAI(api_key=self.api_key, base_url=self.base_url,
+                                       max_retries=0)
+        return self._client
+
+    def generate(self, prompt, on_partial, cancel_event=None, partial_images=None):
+        """Generate an image, calling on_partial(index, image_b64) for each partial
+
+        Returns the base64 data of the final image (or None if the stream
+        produced no images). Raises GenerationCancelled, GenerationTimeout or
+        the underlying API error.
+        """
+        future = asyncio.run_coroutine_threadsafe(
+            self._generate_with_retries(prompt, on_partial, partial_images), self._loop)
+        while True:
+            try:
+                return future.result(timeout=0.25)
+            except concurrent.futures.TimeoutError:
+                if cancel_event is not None and cancel_event.is_set():
+                    # Cancels the task on the loop, which closes the HTTP stream
+                    future.cancel()
+                    raise GenerationCancelled("Generation cancelled")
+            except concurrent.futures.CancelledError:
+                raise GenerationCancelled("Generation cancelled")
+
+    def complete_chat(self, timeout=60.0, **params):
+        """Run a chat completion on the shared client and return the response
+
+        Other modules use this instead of building their own OpenAI client,
+        so the whole app shares one client and connection pool.
+        """
+        future = asyncio.run_coroutine_threadsafe(self._complete_chat(params), self._loop)
+        try:
+            return future.result(timeout=timeout)
+        except concurrent.futures.TimeoutError:
+            future.cancel()
+            raise
+
+    async def _complete_chat(self, params):
+        return await self._get_client().chat.completions.create(**params)
+
+    async def _generate_with_retries(self, prompt, on_partial, partial_images):
+        attempt = 0
+        retryable = (GenerationTimeout, *transient_errors())
+        while True:
+            try:
+                return await self._stream(prompt, on_partial, partial_images)
+            except retryable as e:
+                # A total timeout means we already waited as long as we're
+                # willing to; stalls before the first partial are retried
+                if isinstance(e, GenerationTimeout) and e.stage == 'total':
+                    raise
+                if attempt >= self.max_retries:
+                    raise
+                delay = self.retry_backoff * (2 ** attempt) * random.uniform(0.5, 1.5)
+                attempt += 1
+                GENERATION_RETRIES.inc()
+                print(f"Generation attempt {attempt} failed ({e}), retrying in {delay:.1f}s")
+                await asyncio.sleep(delay)
+
+    async def _stream(self, prompt, on_partial, partial_images):
+        """Run one streaming request with first-partial and total deadlines"""
+        loop = asyncio.get_running_loop()
+        started = time.monotonic()
+        total_deadline = started + self.total_timeout
+        first_deadline = started + self.first_partial_timeout
+
+        try:
+            stream = await asyncio.wait_for(
+                self._get_client().responses.create(
+                    model="gpt-4.1",
+                    input=prompt,
+                    stream=True,
+                    tools=[image_generation_tool(partial_images)],
+                ),
+                timeout=self.first_partial_timeout)
+        except asyncio.TimeoutError:
+            raise GenerationTimeout(
+                f"No response within {self.first_partial_timeout:.0f}s", 'first_partial')
+
+        final_image_data = None
+        events = stream.__aiter__()
+        try:
+            while True:
+                if final_image_data is None:
+                    stage, deadline = 'first_partial', min(first_deadline, total_deadline)
+                else:
+                    stage, deadline = 'total', total_deadline
+                try:
+                    event = await asyncio.wait_for(events.__anext__(),
+                                                   timeout=max(deadline - time.monotonic(), 0))
+                except StopAsyncIteration:
+                    break
+                except asyncio.TimeoutError:
+                    if stage == 'first_partial':
+                        raise GenerationTimeout(
+                            f"No partial image within {self.first_partial_timeout:.0f}s", stage)
+                    raise GenerationTimeout(
+                        f"Generation took longer than {self.total_timeout:.0f}s", stage)
+
+                if event.type == PARTIAL_IMAGE_EVENT:
+                    final_image_data = event.partial_image_b64
+                    # Callbacks do disk and socket I/O, keep them off the loop
+                    await loop.run_in_executor(None, on_partial,
+                                               event.partial_image_index,
+                                               event.partial_image_b64)
+                elif event.type == OUTPUT_ITEM_DONE_EVENT:
+                    # The finished image arrives with the completed tool call,
+                    # however few partials were requested before it
+                    item = event.item
+                    if getattr(item, 'type', None) == 'image_generation_call' and item.result:
+                        final_image_data = item.result
+        finally:
+            await stream.close()
+
+        return final_image_data
+
+
+_engine = None
+_engine_lock = threading.Lock()
+
+
+def get_engine():
+    """Shared engine, created on first use"""
+    global _engine
+    with _engine_lock:
+        if _engine is None:
+            _engine = GenerationEngine(config.OPENAI_API_KEY,
+                                       base_url=config.OPENAI_BASE_URL,
+                                       first_partial_timeout=config.GENERATION_FIRST_PARTIAL_TIMEOUT,
+                                       total_timeout=config.GENERATION_TOTAL_TIMEOUT,
+                                       max_retries=config.GENERATION_MAX_RETRIES,
+                                       retry_backoff=config.GENERATION_RETRY_BACKOFF)
+        return _engine
+
+
+class GenerationRun:
+    """State shared between the sinks of one generation"""
+
+    def __init__(self, prompt, source, run_id=None, metadata=None):
+        self.id = run_id or uuid.uuid4().hex[:12]
+        self.prompt = prompt
+        self.source = source
+        self.metadata = metadata or {}  # e.g. the weather snapshot behind a prompt
+        self.partial_count = 0
+        self.partial_images = None  # Partials requested from the API
+        self.first_partial_seconds = None
+        self.seconds = None  # Start of the stream to the finished image
+        self.final_bytes = None
+        self.archive_path = None
+        self.cached = False
+
+
+class Sink:
+    """Receives images from run_generation; override what you need
+
+    on_partial gets a PartialImage; reading its bytes decodes it (once,
+    shared by every sink), so sinks with nobody to show it to should not.
+    """
+
+    def on_partial(self, run, index, partial):
+        pass
+
+    def on_final(self, run, image_bytes):
+        pass
+
+    def on_abort(self, run, error):
+        pass
+
+    def on_cached(self, run):
+        """Called instead of streaming when run.archive_path came from the prompt cache"""
+        pass
+
+
+class ArchiveSink(Sink):
+    """Writes the final image into the images directory, once
+
+    Files are content-addressed by SHA-256, so identical bytes are only
+    ever stored a single time.
+    """
+
+    def __init__(self, images_dir):
+        self.images_dir = images_dir
+
+    def on_final(self, run, image_bytes):
+        digest = hashlib.sha256(image_bytes).hexdigest()
+        run.archive_path = os.path.join(self.images_dir, f'{digest}.png')
+        if os.path.exists(run.archive_path):
+            return
+        # The one write per generation that must survive a power cut
+        atomic_write_bytes(run.archive_path, image_bytes, durable=True)
+
+
+def run_generation(prompt, sinks, source='user', cancel_event=None, run_id=None,
+                   cache=None, force_fresh=False, metadata=None, partial_images=None,
+                   cached_path=None):
+    """Stream one generation through the shared engine into the given sinks
+
+    Sinks are called in order, so put the archive sink before anything that
+    needs run.archive_path. With a prompt cache, a fresh enough earlier
+    result is handed to the sinks' on_cached instead of calling the API
+    (unless force_fresh). A cached_path the caller has already looked up
+    is served as is, without a second lookup. partial_images overrides
+    config.PARTIAL_IMAGES. Returns the finished GenerationRun.
+    """
+    run = GenerationRun(prompt, source, run_id, metadata)
+    run.partial_images = partial_images or config.PARTIAL_IMAGES
+
+    if cached_path is None and cache is not None and not force_fresh:
+        cached_path = cache.get(prompt)
+    if cached_path:
+        run.archive_path = cached_path
+        run.cached = True
+        for sink in sinks:
+            call_sink(sink, 'on_cached', run)
+        GENERATIONS.inc(source=source, outcome='cached')
+        return run
+
+    started = time.perf_counter()
+    last_partial = None
+
+    def on_partial(index, image_b64):
+        nonlocal last_partial
+        if run.partial_count == 0:
+            run.first_partial_seconds = time.perf_counter() - started
+            FIRST_PARTIAL_SECONDS.observe(run.first_partial_seconds)
+        run.partial_count += 1
+        last_partial = PartialImage(image_b64)
+        for sink in sinks:
+            call_sink(sink, 'on_partial', run, index, last_partial)
+
+    try:
+        final_b64 = get_engine().generate(prompt, on_partial, cancel_event=cancel_event,
+                                          partial_images=run.partial_images)
+    except Exception as e:
+        cancelled = isinstance(e, GenerationCancelled)
+        GENERATIONS.inc(source=source, outcome='cancelled' if cancelled else 'error')
+        for sink in sinks:
+            call_sink(sink, 'on_abort', run, e)
+        raise
+
+    # Only the finished image must be decoded; it's the last partial unless
+    # the stream ended with a completed image of its own
+    run.seconds = time.perf_counter() - started
+    if final_b64 is not None:
+        if last_partial is not None and last_partial.b64 == final_b64:
+            final = last_partial
+        else:
+            final = PartialImage(final_b64)
+        run.final_bytes = final.bytes
+        for sink in sinks:
+            call_sink(sink, 'on_final', run, run.final_bytes)
+        if cache is not None and run.archive_path:
+            cache.put(prompt, run.archive_path)
+        GENERATIONS.inc(source=source, outcome='complete')
+    else:
+        GENERATIONS.inc(source=source, outcome='empty')
+    GENERATION_SECONDS.observe(time.perf_counter() - started, source=source)
+    return run
+
+
+def call_sink(sink, hook, *args):
+    """Call one sink hook, timing it per sink class"""
+    with SINK_SECONDS.time(sink=type(sink).__name__, hook=hook):
+        getattr(sink, hook)(*args)
@@ -0,0 +1,372 @@
+"""
+In-memory image history for the art display
+Navigation happens against memory; changes are batched into a SQLite
+database in WAL mode, so a crash or power cut loses at most the last few
+seconds of history and never corrupts the rest
+"""
+
+import atexit
+import json
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime
+
+from metrics import Histogram
+
+HISTORY_FLUSH_SECONDS = Histogram('art_history_flush_seconds', 'Writing history and position to disk')
+
+
+# Display whose position is stored under the original 'position' key
+DEFAULT_DISPLAY = 'default'
+
+
+def image_id_for_path(path):
+    """Stable public ID for an archived image (its file name without extension)"""
+    return os.path.splitext(os.path.basename(path))[0]
+
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS images (
+    seq INTEGER PRIMARY KEY AUTOINCREMENT,
+    id TEXT NOT NULL,
+    path TEXT NOT NULL,
+    timestamp TEXT NOT NULL,
+    prompt TEXT,
+    source TEXT
+);
+CREATE INDEX IF NOT EXISTS images_id ON images (id);
+CREATE TABLE IF NOT EXISTS state (
+    key TEXT PRIMARY KEY,
+    value TEXT NOT NULL
+);
+"""
+
+
+def open_database(db_path):
+    """Open the state database in WAL mode
+
+    synchronous=NORMAL only fsyncs the WAL at checkpoints, batching many
+    commits into one sync; a power cut can drop the newest commits but
+    never leaves a half-written database.
+    """
+    conn = sqlite3.connect(db_path, check_same_thread=False)
+    conn.execute('PRAGMA journal_mode=WAL')
+    conn.execute('PRAGMA synchronous=NORMAL')
+    conn.executescript(SCHEMA)
+    return conn
+
+
+class ImageHistory:
+    """Thread-safe image history with write-behind persistence
+
+    Entries are kept oldest-first so appending is O(1); position 0 is always
+    the newest image. Every display has its own position in the shared
+    list. Rows are appended by flushes, which write just the entries added
+    since the last one plus the positions; remove() deletes rows directly.
+    """
+
+    def __init__(self, db_path, flush_delay=2.0, legacy_history_file=None,
+                 legacy_position_file=None, displays=(DEFAULT_DISPLAY,)):
+        self.db_path = db_path
+        self.flush_delay = flush_delay
+
+        self._lock = threading.RLock()
+        self._write_lock = threading.Lock()
+        self._entries = []
+        self._index_by_id = {}  # image id -> index into self._entries
+        self._positions = {name: 0 for name in displays}  # display -> newest-first position
+        self._saved_count = 0   # entries already in the database
+        self._dirty = False
+        self._flush_timer = None
+
+        self._conn = self._open()
+        self._load()
+        if not self._entries and legacy_history_file:
+            self._import_legacy(legacy_history_file, legacy_position_file)
+        atexit.register(self.flush)
+
+    def _open(self):
+        """Open the database, setting a damaged one aside instead of losing it silently"""
+        try:
+            conn = open_database(self.db_path)
+            conn.execute('SELECT COUNT(*) FROM images').fetchone()
+            return conn
+        except sqlite3.DatabaseError as e:
+            aside = f"{self.db_path}.corrupt-{int(time.time())}"
+            print(f"WARNING: image history database is unreadable ({e}); "
+                  f"moved to {aside} and starting a new one")
+            for suffix in ('', '-wal', '-shm'):
+                if os.path.exists(self.db_path + suffix):
+                    os.replace(self.db_path + suffix, aside + suffix)
+            return open_database(self.db_path)
+
+    def _load(self):
+        """Read history and position from the database once at startup"""
+        rows = self._conn.execute(
+            'SELECT id, path, timestamp, prompt, source FROM images ORDER BY seq').fetchall()
+        for image_id, path, timestamp, prompt, source in rows:
+            entry = {'id': image_id, 'path': path, 'timestamp': timestamp}
+            if prompt:
+                entry['prompt'] = prompt
+            if source:
+                entry['source'] = source
+            self._entries.append(entry)
+        self._saved_count = len(self._entries)
+
+        for key, value in self._conn.execute(
+                "SELECT key, value FROM state WHERE key = 'position' OR key LIKE 'position:%'"):
+            display = key.partition(':')[2] or DEFAULT_DISPLAY
+            if display in self._positions and 0 <= int(value) < max(len(self._entries), 1):
+                self._positions[display] = int(value)
+
+        for index, entry in enumerate(self._entries):
+            self._index_by_id[entry['id']] = index
+
+    def _import_legacy(self, history_file, position_file):
+        """One-time move from image_history.json / current_position.json"""
+        if not os.path.exists(history_file):
+            return
+        try:
+            with open(history_file, 'r') as f:
+                # File is stored newest-first
+                entries = list(reversed(json.load(f)))
+        except (OSError, ValueError) as e:
+            # Leave the file where it is so it can be repaired by hand
+            print(f"WARNING: could not import {history_file}: {e}")
+            return
+
+        position = 0
+        if position_file and os.path.exists(position_file):
+            try:
+                with open(position_file, 'r') as f:
+                    position = json.load(f).get('position', 0)
+            except (OSError, ValueError):
+                pass
+
+        with self._lock:
+            for entry in entries:
+                entry.setdefault('id', image_id_for_path(entry['path']))
+                self._index_by_id[entry['id']] = len(self._entries)
+                self._entries.append(entry)
+            self._positions[DEFAULT_DISPLAY] = position if 0 <= position < max(len(entries), 1) else 0
+            self._dirty = True
+        self.flush()
+
+        for path in (history_file, position_file):
+            if path and os.path.exists(path):
+                os.replace(path, f"{path}.migrated")
+        print(f"Imported {len(entries)} images from {history_file}")
+
+    def __len__(self):
+        with self._lock:
+            return len(self._entries)
+
+    @property
+    def position(self):
+        with self._lock:
+            return self._positions[DEFAULT_DISPLAY]
+
+    @property
+    def displays(self):
+        return list(self._positions)
+
+    @staticmethod
+    def _position_key(display):
+        return 'position' if display == DEFAULT_DISPLAY else f'position:{display}'
+
+    def _entry_at(self, position):
+        """Return the entry at a newest-first position (caller holds the lock)"""
+        return self._entries[len(self._entries) - 1 - position]
+
+    def _live_position(self, position, step):
+        """First position from position onwards (in direction step) whose file
+        still exists, or None past either end (caller holds the lock)"""
+        while 0 <= position < len(self._entries):
+            if os.path.exists(self._entry_at(position)['path']):
+                return position
+            position += step
+        return None
+
+    def add(self, image_path, prompt=None, source=None, displays=None):
+        """Add a new image as the newest entry and make it current
+
+        Only on the given displays (all of them by default); the others
+        keep showing what they showed before.
+        """
+        with self._lock:
+            entry = {
+                'id': image_id_for_path(image_path),
+                'path': image_path,
+                'timestamp': datetime.now().isoformat()
+            }
+            if prompt:
+                entry['prompt'] = prompt
+            if source:
+                entry['source'] = source
+            self._index_by_id[entry['id']] = len(self._entries)
+            self._entries.append(entry)
+            for display in self._positions:
+                if displays is None or display in displays:
+                    self._positions[display] = 0
+                elif len(self._entries) > 1:
+                    # One more newer image in front of the one it shows
+                    self._positions[display] += 1
+            self._mark_dirty()
+            return entry
+
+    def get(self, image_id):
+        """Look up an entry by its image ID, or None"""
+        with self._lock:
+            index = self._index_by_id.get(image_id)
+            return self._entries[index] if index is not None else None
+
+    def jump(self, image_id, display=DEFAULT_DISPLAY):
+        """Make the entry with the given ID current and return it, or None"""
+        with self._lock:
+            index = self._index_by_id.get(image_id)
+            if index is None:
+                return None
+            self._positions[display] = len(self._entries) - 1 - index
+            self._mark_dirty()
+            return self._entries[index]
+
+    def page(self, cursor=None, limit=50):
+        """Return up to limit entries older than cursor, newest first
+
+        The cursor is an image ID, so pages stay stable while new images are
+        added. Returns (entries, next_cursor); next_cursor is None at the end.
+        """
+        with self._lock:
+            if cursor is None:
+                start = len(self._entries) - 1
+            elif cursor in self._index_by_id:
+                start = self._index_by_id[cursor] - 1
+            else:
+                return [], None
+            stop = max(start - limit, -1)
+            entries = [self._entries[i] for i in range(start, stop, -1)]
+            next_cursor = entries[-1]['id'] if entries and stop >= 0 else None
+            return entries, next_cursor
+
+    def current(self, display=DEFAULT_DISPLAY):
+        """Return the entry at a display's current position, or None"""
+        with self._lock:
+            if not self._entries:
+                return None
+            return self._entry_at(self._positions[display])
+
+    def move(self, offset, display=DEFAULT_DISPLAY):
+        """Move the current position by offset and return the new entry
+
+        Positive offsets go back in time. Entries whose file has been
+        deleted are stepped over. Returns None (and leaves the position
+        unchanged) when the move would run off either end.
+        """
+        with self._lock:
+            new_pos = self._live_position(self._positions[display] + offset,
+                                          1 if offset >= 0 else -1)
+            if new_pos is None:
+                return None
+            self._positions[display] = new_pos
+            self._mark_dirty()
+            return self._entry_at(new_pos)
+
+    def peek(self, offset, display=DEFAULT_DISPLAY):
+        """Return the entry move(offset) would land on without moving, or None"""
+        with self._lock:
+            pos = self._live_position(self._positions[display] + offset,
+                                      1 if offset >= 0 else -1)
+            return self._entry_at(pos) if pos is not None else None
+
+    def remove(self, image_ids):
+        """Drop every entry for the given image IDs (e.g. deleted archives)
+
+        Every display's current entry stays current; if it is itself
+        removed, that display moves to the next older image. Returns the
+        number of entries removed.
+        """
+        image_ids = set(image_ids)
+        # Holding the write lock keeps a flush from interleaving with the delete
+        with self._write_lock:
+            with self._lock:
+                currents = {display: self._entry_at(position) if self._entries else None
+                            for display, position in self._positions.items()}
+                kept = [entry for entry in self._entries if entry['id'] not in image_ids]
+                removed = len(self._entries) - len(kept)
+                if not removed:
+                    return 0
+                self._saved_count -= sum(1 for entry in self._entries[:self._saved_count]
+                                         if entry['id'] in image_ids)
+                self._entries = kept
+                self._index_by_id = {entry['id']: index for index, entry in enumerate(kept)}
+                for display, current in currents.items():
+                    position = 0
+                    if current is not None and current['id'] in self._index_by_id:
+                        position = len(kept) - 1 - self._index_by_id[current['id']]
+                    elif kept:
+                        position = min(self._positions[display], len(kept) - 1)
+                    self._positions[display] = position
+                positions = dict(self._positions)
+
+            try:
+                with self._conn:
+                    self._conn.executemany('DELETE FROM images WHERE id = ?',
+                                           [(image_id,) for image_id in image_ids])
+                    self._conn.executemany(
+                        "INSERT OR REPLACE INTO state (key, value) VALUES (?, ?)",
+                        [(self._position_key(display), str(position))
+                         for display, position in positions.items()])
+            except sqlite3.Error as e:
+                print(f"Could not remove images from history: {e}")
+            return removed
+
+    def previous(self, display=DEFAULT_DISPLAY):
+        """Step to the previous (older) image"""
+        return self.move(1, display)
+
+    def next(self, display=DEFAULT_DISPLAY):
+        """Step to the next (newer) image"""
+        return self.move(-1, display)
+
+    def _mark_dirty(self):
+        """Schedule a write-behind flush (caller holds the lock)"""
+        self._dirty = True
+        if self._flush_timer is None:
+            self._flush_timer = threading.Timer(self.flush_delay, self.flush)
+            self._flush_timer.daemon = True
+            self._flush_timer.start()
+
+    def flush(self):
+        """Persist new entries and the positions in one transaction if anything changed"""
+        # Serialize writers so an older snapshot never lands after a newer one
+        with self._write_lock:
+            with self._lock:
+                if self._flush_timer is not None:
+                    self._flush_timer.cancel()
+                    self._flush_timer = None
+                if not self._dirty:
+                    return
+                new_entries = self._entries[self._saved_count:]
+                saved_count = len(self._entries)
+                positions = dict(self._positions)
+                self._dirty = False
+
+            try:
+                with HISTORY_FLUSH_SECONDS.time(), self._conn:
+                    self._conn.executemany(
+                        'INSERT INTO images (id, path, timestamp, prompt, source) '
+                        'VALUES (?, ?, ?, ?, ?)',
+                        [(entry['id'], entry['path'], entry['timestamp'],
+                          entry.get('prompt'), entry.get('source')) for entry in new_entries])
+                    self._conn.executemany(
+                        "INSERT OR REPLACE INTO state (key, value) VALUES (?, ?)",
+                        [(self._position_key(display), str(position))
+                         for display, position in positions.items()])
+                with self._lock:
+                    self._saved_count = saved_count
+            except sqlite3.Error as e:
+                print(f"Could not save image history: {e}")
+                with self._lock:
+                    self._mark_dirty()
@@ -0,0 +1,153 @@
+"""
+Generation job queue for the art display
+Jobs wait in a bounded priority queue and are drained by a small worker pool
+"""
+
+import heapq
+import itertools
+import threading
+import uuid
+from datetime import datetime
+
+# Lower numbers run first
+PRIORITY_USER = 0
+PRIORITY_SCHEDULED = 10
+
+
+class QueueFull(Exception):
+    """Raised when a job is submitted to a full queue"""
+
+
+class Job:
+    """A single queued generation; displays are the ones it's for (None means all)"""
+
+    def __init__(self, task, priority, source, prompt=None, displays=None):
+        self.id = uuid.uuid4().hex[:12]
+        self.task = task
+        self.priority = priority
+        self.source = source
+        self.prompt = prompt
+        self.displays = displays
+        self.status = 'queued'
+        self.created = datetime.now().isoformat()
+        self.cancel_event = threading.Event()
+
+    @property
+    def cancelled(self):
+        return self.cancel_event.is_set()
+
+    def to_dict(self):
+        return {
+            'job_id': self.id,
+            'source': self.source,
+            'prompt': self.prompt,
+            'displays': self.displays,
+            'status': self.status,
+            'created': self.created
+        }
+
+
+class JobQueue:
+    """Bounded priority queue of generation jobs with a worker pool
+
+    on_status(job, message) is called whenever a job changes state.
+    """
+
+    def __init__(self, max_size=10, workers=1, on_status=None):
+        self.max_size = max_size
+        self.on_status = on_status or (lambda job, message: None)
+
+        self._cond = threading.Condition()
+        self._heap = []
+        self._counter = itertools.count()  # FIFO order within a priority
+        self._jobs = {}  # job id -> job, for queued and running jobs
+
+        for i in range(workers):
+            worker = threading.Thread(target=self._worker, name=f'generation-{i}', daemon=True)
+            worker.start()
+
+    def submit(self, task, priority=PRIORITY_USER, source='user', prompt=None, displays=None):
+        """Queue task(job) to run on a worker and return the job"""
+        job = Job(task, priority, source, prompt, displays)
+        with self._cond:
+            if self._queued_count() >= self.max_size:
+                raise QueueFull('Generation queue is full')
+            heapq.heappush(self._heap, (priority, next(self._counter), job))
+            self._jobs[job.id] = job
+            self._cond.notify()
+        self._set_status(job, 'queued', 'Waiting in queue')
+        return job
+
+    def cancel(self, job_id):
+        """Cancel a queued or running job; returns False if it isn't known"""
+        with self._cond:
+            job = self._jobs.get(job_id)
+            if job is None:
+                return False
+            job.cancel_event.set()
+            was_queued = job.status == 'queued'
+            if was_queued:
+                # Left in the heap and skipped when popped
+                del self._jobs[job_id]
+        if was_queued:
+            self._set_status(job, 'cancelled', 'Generation cancelled')
+        # Running jobs notice the cancel event and report for themselves
+        return True
+
+    def position(self, job_id):
+        """1-based position of a queued job, or None"""
+        with self._cond:
+            queued = sorted(entry for entry in self._heap if not entry[2].cancelled)
+            for index, (_, _, job) in enumerate(queued):
+                if job.id == job_id:
+                    return index + 1
+        return None
+
+    def depth(self):
+        """Number of jobs waiting to run"""
+        with self._cond:
+            return self._queued_count()
+
+    def snapshot(self):
+        """Queued and running jobs, running first then in queue order"""
+        with self._cond:
+            running = [job for job in self._jobs.values() if job.status == 'running']
+            queued = [job for _, _, job in sorted(self._heap) if not job.cancelled]
+            return [job.to_dict() for job in running + queued]
+
+    def _queued_count(self):
+        """Queued jobs that haven't been cancelled (caller holds the lock)"""
+        return sum(1 for _, _, job in self._heap if not job.cancelled)
+
+    def _set_status(self, job, status, message):
+        job.status = status
+        try:
+            self.on_status(job, message)
+        except Exception as e:
+            print(f"Job status callback failed: {e}")
+
+    def _worker(self):
+        while True:
+            with self._cond:
+                while not self._heap:
+                    self._cond.wait()
+                _, _, job = heapq.heappop(self._heap)
+                if job.cancelled:
+                    continue
+                job.status = 'running'
+
+            self._set_status(job, 'running', 'Starting image generation...')
+            try:
+                job.task(job)
+                if job.cancelled:
+                    self._set_status(job, 'cancelled', 'Generation cancelled')
+                else:
+                    self._set_status(job, 'complete', 'Image generation complete!')
+            except Exception as e:
+                if job.cancelled:
+                    self._set_status(job, 'cancelled', 'Generation cancelled')
+                else:
+                    self._set_status(job, 'error', f'Error generating image: {str(e)}')
+            finally:
+                with self._cond:
+                    self._jobs.pop(job.id, None)
@@ -0,0 +1,172 @@
+"""
+In-memory buffer of streamed partial images
+Partials are throwaway previews, so they stay in a small ring buffer
+instead of being written to the SD card. While a generation streams,
+/current-image serves the newest one straight from memory.
+Partials are kept as the base64 the API sent and only decoded when a
+display actually needs the bytes, and the number requested per generation
+is planned from how fast the displays have been receiving them.
+"""
+
+import base64
+import collections
+import threading
+import time
+
+from metrics import Histogram
+
+PARTIAL_DECODE_SECONDS = Histogram('art_partial_decode_seconds', 'Base64 decode of one partial image')
+
+
+def partial_version(run_id, index):
+    """Version tag of one partial, comparable with archived image versions"""
+    return f'{run_id}-p{index}'
+
+
+class PartialImage:
+    """One streamed partial, decoded on first use and at most once"""
+
+    def __init__(self, image_b64):
+        self.b64 = image_b64
+        self._bytes = None
+        self._lock = threading.Lock()
+
+    @property
+    def bytes(self):
+        with self._lock:
+            if self._bytes is None:
+                with PARTIAL_DECODE_SECONDS.time():
+                    self._bytes = base64.b64decode(self.b64)
+            return self._bytes
+
+
+class PartialBuffer:
+    """The last few partials of the generations currently streaming"""
+
+    def __init__(self, size):
+        self._lock = threading.Lock()
+        self._partials = collections.deque(maxlen=size)
+
+    def add(self, run_id, index, image, displays=None):
+        """Keep a PartialImage; displays limits who sees it (None means every display)"""
+        with self._lock:
+            self._partials.append({
+                'run_id': run_id,
+                'index': index,
+                'version': partial_version(run_id, index),
+                'displays': displays,
+                'image': image
+            })
+
+    def latest(self, display=None):
+        """Newest partial streaming to a display (or to any), or None"""
+        with self._lock:
+            for partial in reversed(self._partials):
+                if display is None or partial['displays'] is None or display in partial['displays']:
+                    return partial
+            return None
+
+    def finish(self, run_id):
+        """Drop a run's partials once it's archived or aborted; True if it had any"""
+        with self._lock:
+            kept = [partial for partial in self._partials if partial['run_id'] != run_id]
+            dropped = len(kept) != len(self._partials)
+            self._partials.clear()
+            self._partials.extend(kept)
+        return dropped
+
+    def __len__(self):
+        with self._lock:
+            return len(self._partials)
+
+
+class PartialPlanner:
+    """Picks how many partials to request from measured delivery speed
+
+    Displays acknowledge each partial they receive, which gives the time a
+    partial takes to reach them. A preview is only worth streaming if the
+    slowest subscribed display can download it before the next one, so the
+    count is the number of partial downloads that fit in the time partials
+    take to stream (first partial to finished image). Until both have been
+    measured the default is used; with nobody watching, the minimum.
+    """
+
+    def __init__(self, default, minimum=1, maximum=10, smoothing=0.3, tracked=50):
+        self.default = default
+        self.minimum = minimum
+        self.maximum = maximum
+        self.smoothing = smoothing
+        self._lock = threading.Lock()
+        self._sent = collections.OrderedDict()  # version -> (monotonic time, bytes)
+        self._tracked = tracked
+        self._bandwidth = {}  # display -> bytes per second
+        self._partial_bytes = None
+        self._stream_seconds = None
+        self._planned = collections.OrderedDict()  # run id -> partials requested
+
+    def _average(self, old, new):
+        return new if old is None else old + self.smoothing * (new - old)
+
+    def sent(self, version, size):
+        """A partial of size bytes went out to the displays"""
+        with self._lock:
+            self._sent[version] = (time.monotonic(), size)
+            while len(self._sent) > self._tracked:
+                self._sent.popitem(last=False)
+            self._partial_bytes = self._average(self._partial_bytes, size)
+
+    def received(self, display, version):
+        """A display acknowledged a partial; returns its measured bytes/s or None"""
+        with self._lock:
+            if version not in self._sent:
+                return None
+            sent_at, size = self._sent[version]
+            rate = size / max(time.monotonic() - sent_at, 0.001)
+            # Every client of a display feeds the same average, so one slow
+            # client pulls the display's figure down
+            self._bandwidth[display] = self._average(self._bandwidth.get(display), rate)
+            return rate
+
+    def observe(self, first_partial_seconds, total_seconds, partial_count):
+        """Timing of a finished generation that streamed partials"""
+        # With a single partial, the first one is the finished image and
+        # says nothing about how long the previews take to stream
+        if partial_count < 2 or first_partial_seconds is None or total_seconds is None:
+            return
+        with self._lock:
+            self._stream_seconds = self._average(self._stream_seconds,
+                                                 max(total_seconds - first_partial_seconds, 0))
+
+    def choose(self, displays, run_id=None):
+        """Partials to request for a generation watched by the given displays"""
+        with self._lock:
+            rates = [self._bandwidth[display] for display in displays
+                     if display in self._bandwidth]
+            if not displays:
+                count = self.minimum
+            elif not rates or self._partial_bytes is None or self._stream_seconds is None:
+                count = self.default
+            else:
+                transfer = self._partial_bytes / min(rates)
+                count = 1 + int(self._stream_seconds / transfer)
+            count = max(self.minimum, min(self.maximum, count))
+            if run_id is not None:
+                self._planned[run_id] = count
+                while len(self._planned) > self._tracked:
+                    self._planned.popitem(last=False)
+        return count
+
+    def planned(self, run_id):
+        """Partials requested for a run, or the default if it wasn't planned here"""
+        with self._lock:
+            return self._planned.get(run_id, self.default)
+
+    def stats(self):
+        """The measurements behind the plan, for /healthz"""
+        with self._lock:
+            return {
+                'bandwidth': {display: round(rate) for display, rate in self._bandwidth.items()},
+                'partial_bytes': round(self._partial_bytes) if self._partial_bytes else None,
+                'stream_seconds': (round(self._stream_seconds, 2)
+                                   if self._stream_seconds is not None else None)
+            }
@@ -0,0 +1,91 @@
+"""
+Placeholder artwork shown before the first generation
+Rendered once per size and text, then reused from disk
+"""
+
+import functools
+import hashlib
+import os
+
+try:
+    from PIL import Image, ImageDraw, ImageFont
+    PIL_AVAILABLE = True
+except ImportError:
+    PIL_AVAILABLE = False
+
+FONT_PATH = "/usr/share/fonts/truetype/dejavu/DejaVuSans.ttf"
+
+# PNG for a 1x1 black image, used when PIL isn't installed
+MINIMAL_PNG = b'\x89PNG\r\n\x1a\n\x00\x00\x00\rIHDR\x00\x00\x00\x01\x00\x00\x00\x01\x08\x00\x00\x00\x00:~\x9bU\x00\x00\x00\x0bIDATx\x9cc\xf8\x00\x00\x00\x01\x00\x01UU\x86\x18\x00\x00\x00\x00IEND\xaeB`\x82'
+
+# Top and bottom colors of the dark blue to purple background
+GRADIENT_TOP = (30, 40, 80)
+GRADIENT_BOTTOM = (80, 70, 180)
+
+
+@functools.lru_cache(maxsize=None)
+def load_font(size):
+    """Load a font once per size"""
+    try:
+        return ImageFont.truetype(FONT_PATH, size)
+    except OSError:
+        return ImageFont.load_default()
+
+
+def render_gradient(width, height):
+    """Vertical gradient built as a single column and stretched, not drawn row by row"""
+    ramp = Image.linear_gradient('L').resize((1, height), Image.BILINEAR)
+    channels = []
+    for top, bottom in zip(GRADIENT_TOP, GRADIENT_BOTTOM):
+        lut = [top + (bottom - top) * v // 255 for v in range(256)]
+        channels.append(ramp.point(lut))
+    return Image.merge('RGB', channels).resize((width, height), Image.NEAREST)
+
+
+def render_placeholder(path, width, height, title, subtitle):
+    """Draw the placeholder and write it to path"""
+    if not PIL_AVAILABLE:
+        with open(path, 'wb') as f:
+            f.write(MINIMAL_PNG)
+        return
+
+    img = render_gradient(width, height)
+    draw = ImageDraw.Draw(img)
+
+    font = load_font(60)
+    text_bbox = draw.textbbox((0, 0), title, font=font)
+    text_width = text_bbox[2] - text_bbox[0]
+    text_height = text_bbox[3] - text_bbox[1]
+
+    # Center the text
+    x = (width - text_width) // 2
+    y = (height - text_height) // 2
+
+    # Draw text with shadow
+    draw.text((x+3, y+3), title, fill=(0, 0, 0), font=font)
+    draw.text((x, y), title, fill=(255, 255, 255), font=font)
+
+    # Add subtitle
+    subtitle_font = load_font(30)
+    subtitle_bbox = draw.textbbox((0, 0), subtitle, font=subtitle_font)
+    subtitle_width = subtitle_bbox[2] - subtitle_bbox[0]
+    sx = (width - subtitle_width) // 2
+    sy = y + text_height + 40
+    draw.text((sx, sy), subtitle, fill=(200, 200, 200), font=subtitle_font)
+
+    # Low compression: this is about first paint, not file size
+    tmp_path = f"{path}.tmp"
+    img.save(tmp_path, 'PNG', compress_level=1)
+    os.replace(tmp_path, path)
+
+
+def get_placeholder(cache_dir, width=1536, height=1024, title="Art Display",
+                    subtitle="Initializing..."):
+    """Path of the placeholder for this size and text, rendering it only once"""
+    key = hashlib.sha256(f"{width}x{height}|{title}|{subtitle}|{PIL_AVAILABLE}".encode()).hexdigest()[:16]
+    path = os.path.join(cache_dir, f"placeholder_{key}.png")
+    if not os.path.exists(path):
+        os.makedirs(cache_dir, exist_ok=True)
+        render_placeholder(path, width, height, title, subtitle)
+        print(f"Created placeholder image at {path}")
+    return path
@@ -0,0 +1,82 @@
+"""
+Prompt-to-image result cache
+Maps a normalized prompt plus the image tool settings to an archived image
+so repeated prompts are served without another generation call
+"""
+
+import hashlib
+import json
+import os
+import threading
+import time
+
+import config
+from generation import image_generation_tool
+from storage import atomic_write_json
+from metrics import Counter
+
+PROMPT_CACHE_LOOKUPS = Counter('art_prompt_cache_lookups', 'Prompt cache lookups by result', ['result'])
+
+
+def normalize_prompt(prompt):
+    """Case- and whitespace-insensitive form of a prompt"""
+    return ' '.join(prompt.lower().split())
+
+
+class PromptCache:
+    """Persistent prompt -> image path cache with a TTL"""
+
+    def __init__(self, cache_file, ttl):
+        self.cache_file = cache_file
+        self.ttl = ttl
+        self._lock = threading.Lock()
+        self._entries = {}
+
+        if os.path.exists(cache_file):
+            try:
+                with open(cache_file, 'r') as f:
+                    self._entries = json.load(f)
+            except (OSError, ValueError) as e:
+                print(f"Could not load prompt cache: {e}")
+
+    @staticmethod
+    def key(prompt):
+        """Cache key covering everything that shapes the generated image"""
+        tool = image_generation_tool()
+        params = {
+            'prompt': normalize_prompt(prompt),
+            'quality': tool['quality'],
+            'size': tool['size'],
+            'moderation': tool['moderation'],
+            'style': config.DEFAULT_STYLE
+        }
+        return hashlib.sha256(json.dumps(params, sort_keys=True).encode()).hexdigest()
+
+    def get(self, prompt):
+        """Path of a cached image for this prompt, or None if missing or expired"""
+        key = self.key(prompt)
+        with self._lock:
+            entry = self._entries.get(key)
+        if entry is None:
+            PROMPT_CACHE_LOOKUPS.inc(result='miss')
+            return None
+        if time.time() - entry['created'] > self.ttl or not os.path.exists(entry['path']):
+            with self._lock:
+                self._entries.pop(key, None)
+            PROMPT_CACHE_LOOKUPS.inc(result='expired')
+            return None
+        PROMPT_CACHE_LOOKUPS.inc(result='hit')
+        return entry['path']
+
+    def put(self, prompt, image_path):
+        """Remember the image generated for a prompt"""
+        with self._lock:
+            self._entries[self.key(prompt)] = {'path': image_path, 'created': time.time()}
+            now = time.time()
+            # Drop expired entries while we're rewriting the file anyway
+            self._entries = {key: entry for key, entry in self._entries.items()
+                             if now - entry['created'] <= self.ttl}
+            try:
+                atomic_write_json(self.cache_file, self._entries)
+            except OSError as e:
+                print(f"Could not save prompt cache: {e}")
@@ -0,0 +1,209 @@
+"""
+Storage retention for the image archive
+A background worker keeps the archive inside a byte budget and age limit
+by deleting the oldest images that aren't favorites or on display, and
+losslessly re-encodes older archives as optimized PNGs to save space.
+Deletions are removed from the catalog and history so nothing points at
+a missing file. Recompressed files keep their name (the hash of the bytes
+as generated, which still identifies the same pixels); the catalog's
+sha256 is updated to the new contents.
+"""
+
+import hashlib
+import io
+import os
+import sqlite3
+import threading
+import time
+from datetime import datetime, timedelta
+
+from derivatives import run_blocking
+from history import open_database
+from metrics import Counter
+from storage import atomic_write_bytes
+
+try:
+    from PIL import Image
+    PIL_AVAILABLE = True
+except ImportError:
+    PIL_AVAILABLE = False
+
+RETENTION_RECLAIMED_BYTES = Counter('art_retention_reclaimed_bytes',
+                                    'Bytes freed in the images directory', ['action'])
+RETENTION_FILES = Counter('art_retention_files', 'Archives deleted or recompressed', ['action'])
+
+SCHEMA = """
+CREATE TABLE IF NOT EXISTS retention (
+    id TEXT PRIMARY KEY,
+    original_bytes INTEGER NOT NULL,
+    stored_bytes INTEGER NOT NULL,
+    recompressed TEXT NOT NULL
+);
+"""
+
+
+def _optimize_png(path):
+    """Re-encode a PNG with maximum compression; pixels are unchanged"""
+    with Image.open(path) as img:
+        img.load()
+        buffer = io.BytesIO()
+        img.save(buffer, 'PNG', optimize=True)
+    return buffer.getvalue()
+
+
+class RetentionManager:
+    """Deletes and recompresses archives in a low-priority background thread
+
+    protected() returns image IDs that must not be deleted (the image on
+    display, its neighbours, pending reveals); busy() returns True while a
+    generation is running, and the worker waits for it to finish rather
+    than compete with it for the CPU.
+    """
+
+    def __init__(self, db_path, catalog, history, max_bytes, max_age_days=None,
+                 recompress_after_days=None, interval=6 * 3600, pause=1.0,
+                 protected=None, busy=None, on_removed=None):
+        self.catalog = catalog
+        self.history = history
+        self.max_bytes = max_bytes
+        self.max_age = timedelta(days=max_age_days) if max_age_days else None
+        self.recompress_after = (timedelta(days=recompress_after_days)
+                                 if recompress_after_days is not None else None)
+        self.interval = interval
+        self.pause = pause
+        self.protected = protected or set
+        self.busy = busy or (lambda: False)
+        self.on_removed = on_removed or (lambda image_ids: None)
+
+        self._lock = threading.Lock()
+        self._conn = open_database(db_path)
+        self._conn.executescript(SCHEMA)
+        self._last_run = None
+
+    def start(self):
+        thread = threading.Thread(target=self._run, name='retention', daemon=True)
+        thread.start()
+
+    def _run(self):
+        while True:
+            try:
+                self.run_once()
+            except Exception as e:
+                print(f"Retention pass failed: {e}")
+            time.sleep(self.interval)
+
+    def _wait_until_idle(self):
+        """Yield to generations and rest between files"""
+        time.sleep(self.pause)
+        while self.busy():
+            time.sleep(max(self.pause, 5.0))
+
+    def _images(self):
+        """Catalogued archives still on disk as (id, path, created, favorite, size)"""
+        images = []
+        for image_id, path, created, favorite in self.catalog.oldest_first():
+            try:
+                size = os.path.getsize(path)
+            except OSError:
+                continue
+            images.append((image_id, path, created, favorite, size))
+        return images
+
+    def run_once(self, now=None):
+        """One full pass: age and budget deletions first, then recompression
+
+        Returns the bytes reclaimed by each action.
+        """
+        now = now or datetime.now()
+        reclaimed = {'delete': self._prune(now), 'recompress': self._recompress(now)}
+        self._last_run = now
+        total = sum(reclaimed.values())
+        if total:
+            print(f"Retention reclaimed {total / 1024 / 1024:.1f} MB "
+                  f"({reclaimed['delete'] / 1024 / 1024:.1f} MB deleted, "
+                  f"{reclaimed['recompress'] / 1024 / 1024:.1f} MB recompressed)")
+        return reclaimed
+
+    def _prune(self, now):
+        images = self._images()
+        total = sum(size for *_, size in images)
+        protected = set(self.protected())
+        doomed = []
+        for image_id, path, created, favorite, size in images:
+            if favorite or image_id in protected:
+                continue
+            too_old = self.max_age is not None and now - datetime.fromisoformat(created) > self.max_age
+            if not too_old and total <= self.max_bytes:
+                continue
+            doomed.append((image_id, path))
+            total -= size
+
+        freed = 0
+        for image_id, path in doomed:
+            try:
+                size = os.path.getsize(path)
+                os.remove(path)
+            except OSError as e:
+                print(f"Could not delete {path}: {e}")
+                continue
+            self.catalog.remove(image_id)
+            with self._lock, self._conn:
+                self._conn.execute('DELETE FROM retention WHERE id = ?', (image_id,))
+            freed += size
+        if doomed:
+            removed_ids = [image_id for image_id, _ in doomed]
+            self.history.remove(removed_ids)
+            self.on_removed(removed_ids)
+            RETENTION_FILES.inc(len(doomed), action='delete')
+            RETENTION_RECLAIMED_BYTES.inc(freed, action='delete')
+        return freed
+
+    def _recompress(self, now):
+        if not PIL_AVAILABLE or self.recompress_after is None:
+            return 0
+        with self._lock:
+            done = {row[0] for row in self._conn.execute('SELECT id FROM retention')}
+        freed = 0
+        for image_id, path, created, favorite, size in self._images():
+            if image_id in done or not path.endswith('.png'):
+                continue
+            if now - datetime.fromisoformat(created) < self.recompress_after:
+                continue
+            self._wait_until_idle()
+            try:
+                data = run_blocking(_optimize_png, path)
+                if len(data) < size and os.path.exists(path):
+                    atomic_write_bytes(path, data, durable=True)
+                    self.catalog.set_sha256(image_id, hashlib.sha256(data).hexdigest())
+                    freed += size - len(data)
+                    RETENTION_FILES.inc(action='recompress')
+                stored = min(len(data), size)
+            except (OSError, ValueError) as e:
+                print(f"Could not recompress {path}: {e}")
+                continue
+            try:
+                with self._lock, self._conn:
+                    self._conn.execute('INSERT OR REPLACE INTO retention VALUES (?, ?, ?, ?)',
+                                       (image_id, size, stored, now.isoformat()))
+            except sqlite3.Error as e:
+                print(f"Could not record recompression of {path}: {e}")
+        RETENTION_RECLAIMED_BYTES.inc(freed, action='recompress')
+        return freed
+
+    def stats(self):
+        """Archive size against the budget, and what recompression has saved so far"""
+        images = self._images()
+        with self._lock:
+            recompressed, saved = self._conn.execute(
+                'SELECT COUNT(*), COALESCE(SUM(original_bytes - stored_bytes), 0) '
+                'FROM retention').fetchone()
+        return {
+            'images': len(images),
+            'bytes': sum(size for *_, size in images),
+            'max_bytes': self.max_bytes,
+            'max_age_days': self.max_age.days if self.max_age else None,
+            'favorites': sum(1 for image in images if image[3]),
+            'recompressed': recompressed,
+            'recompressed_saved_bytes': saved,
+            'last_run': self._last_run.isoformat() if self._last_run else None
+        }
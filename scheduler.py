@@ -0,0 +1,171 @@
+"""
+In-process scheduler for timed art generation
+Rules fire a little ahead of their target time so the result can be ready
+on the minute; the last target of each rule is persisted once its work has
+succeeded, so restarts don't repeat it, and failed runs are retried with
+backoff
+"""
+
+import json
+import os
+import threading
+import time
+from datetime import datetime, timedelta
+
+from storage import atomic_write_json
+
+
+def parse_clock(value):
+    """'07:00' -> datetime.time(7, 0)"""
+    return datetime.strptime(value, '%H:%M').time()
+
+
+def in_quiet_hours(moment, quiet_hours):
+    """True if moment falls inside a (start, end) clock range, which may wrap midnight"""
+    if not quiet_hours:
+        return False
+    start, end = (parse_clock(value) for value in quiet_hours)
+    now = moment.time()
+    if start <= end:
+        return start <= now < end
+    return now >= start or now < end
+
+
+class Rule:
+    """A named schedule: daily at a clock time, or every N minutes
+
+    lead_minutes starts the work that long before the target time.
+    """
+
+    def __init__(self, name, at=None, every_minutes=None, lead_minutes=0):
+        if (at is None) == (every_minutes is None):
+            raise ValueError(f"Rule {name!r} needs exactly one of 'at' or 'every_minutes'")
+        self.name = name
+        self.at = parse_clock(at) if at else None
+        self.every = timedelta(minutes=every_minutes) if every_minutes else None
+        self.lead = timedelta(minutes=lead_minutes)
+
+    def next_target(self, last_target, now):
+        """The next target time after last_target; may already be in the past"""
+        if self.every is not None:
+            if last_target is None:
+                return now
+            return last_target + self.every
+
+        today = datetime.combine(now.date(), self.at)
+        if last_target is not None and last_target >= today:
+            return today + timedelta(days=1)
+        # Due later today, or overdue if today's time has already passed
+        return today
+
+
+class Scheduler:
+    """Runs rules on a background thread
+
+    on_fire(rule, target) is called at target - lead; target is in the past
+    for a rule that was missed while the server was down. The work it starts
+    reports back through finished(); until then the rule doesn't fire again,
+    and a failure is retried after retry_backoff seconds, doubling up to
+    retry_max, until the rule's next target comes round.
+    """
+
+    def __init__(self, rules, state_file, on_fire, quiet_hours=None,
+                 retry_backoff=120, retry_max=1800):
+        self.rules = rules
+        self.state_file = state_file
+        self.on_fire = on_fire
+        self.quiet_hours = quiet_hours
+        self.retry_backoff = retry_backoff
+        self.retry_max = retry_max
+
+        self._lock = threading.Lock()
+        self._running = set()   # rules whose work hasn't reported back yet
+        self._retries = {}      # rule name -> (target, retry at, failed attempts)
+        self._last = {}
+        if os.path.exists(state_file):
+            try:
+                with open(state_file, 'r') as f:
+                    self._last = {name: datetime.fromisoformat(value)
+                                  for name, value in json.load(f).items()}
+            except (OSError, ValueError) as e:
+                print(f"Could not load scheduler state: {e}")
+
+    def start(self):
+        thread = threading.Thread(target=self._run, name='scheduler', daemon=True)
+        thread.start()
+
+    def _next(self, rule, now):
+        """Next (start, target) for a rule, skipping targets in quiet hours"""
+        if rule.name in self._retries:
+            target, retry_at, _ = self._retries[rule.name]
+            return retry_at, target
+        target = rule.next_target(self._last.get(rule.name), now)
+        step = rule.every or timedelta(days=1)
+        if target < now and in_quiet_hours(now, self.quiet_hours):
+            # Missed while we were down, and catching up now would be too late
+            while target < now:
+                target += step
+        for _ in range(1000):
+            if not in_quiet_hours(target, self.quiet_hours):
+                break
+            target += step
+        return target - rule.lead, target
+
+    def upcoming(self):
+        """Next target time of every rule, for display"""
+        now = datetime.now()
+        return {rule.name: self._next(rule, now)[1].isoformat() for rule in self.rules}
+
+    def _save(self):
+        try:
+            atomic_write_json(self.state_file, {name: value.isoformat()
+                                                for name, value in self._last.items()})
+        except OSError as e:
+            print(f"Could not save scheduler state: {e}")
+
+    def finished(self, rule, target, success):
+        """Record the outcome of the work a rule fired; failures are retried"""
+        now = datetime.now()
+        with self._lock:
+            self._running.discard(rule.name)
+            if not success:
+                _, _, attempts = self._retries.get(rule.name, (target, now, 0))
+                delay = min(self.retry_backoff * 2 ** attempts, self.retry_max)
+                retry_at = now + timedelta(seconds=delay)
+                # Give up once the next regular run is due anyway
+                next_target = target + (rule.every or timedelta(days=1))
+                if retry_at < next_target - rule.lead and not in_quiet_hours(retry_at, self.quiet_hours):
+                    self._retries[rule.name] = (target, retry_at, attempts + 1)
+                    print(f"Scheduled rule {rule.name} failed, retrying at {retry_at:%H:%M}")
+                    return
+                print(f"Scheduled rule {rule.name} failed, skipping {target:%Y-%m-%d %H:%M}")
+            self._retries.pop(rule.name, None)
+            # Overdue interval rules restart their cadence from now
+            self._last[rule.name] = max(target, now) if rule.every else target
+            self._save()
+
+    def _run(self):
+        while True:
+            now = datetime.now()
+            with self._lock:
+                due = [self._next(rule, now) + (rule,) for rule in self.rules
+                       if rule.name not in self._running]
+            if not due:
+                time.sleep(60)
+                continue
+            start, target, rule = min(due, key=lambda item: item[0])
+            wait = (start - now).total_seconds()
+            if wait > 0:
+                # Wake at least once a minute so clock changes and finished
+                # runs are picked up
+                time.sleep(min(wait, 60))
+                continue
+
+            with self._lock:
+                self._running.add(rule.name)
+            print(f"Scheduler firing {rule.name} for {target:%Y-%m-%d %H:%M}")
+            try:
+                self.on_fire(rule, target)
+            except Exception as e:
+                print(f"Scheduled rule {rule.name} failed: {e}")
+                self.finished(rule, target, success=False)
@@ -0,0 +1,36 @@
+#!/usr/bin/env python3
+"""
+Production entry point for the art display
+Runs the app on gevent instead of the Werkzeug development server: one
+greenlet per connection, so image downloads and WebSocket fan-out no
+longer tie up an OS thread each
+"""
+
+# Must run before anything else imports socket, ssl or threading.
+# aggressive=False keeps select.epoll, which the OpenAI client's async
+# HTTP stack looks for at import time
+from gevent import monkey
+monkey.patch_all(aggressive=False)
+
+import ssl
+
+import config
+import app as art_app
+
+
+def main():
+    art_app.startup()
+
+    context = ssl.create_default_context(ssl.Purpose.CLIENT_AUTH)
+    context.load_cert_chain('certs/cert.pem', 'certs/key.pem')
+
+    print(f"Serving on {config.HOST}:{config.PORT} ({art_app.socketio.async_mode})")
+    art_app.socketio.run(art_app.app,
+                         host=config.HOST,
+                         port=config.PORT,
+                         ssl_context=context,
+                         log_output=False)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,53 @@
+"""
+Crash-safe file writes
+Files are written to a temp file in the same directory and renamed into
+place, so a reader (or a reboot) sees the old file or the new one, never a
+torn one. Durable writes also fsync the data and the directory entry; live
+previews skip that, since losing one in a power cut costs nothing.
+"""
+
+import json
+import os
+import tempfile
+
+
+def fsync_dir(directory):
+    """Make a rename in directory survive a power cut"""
+    try:
+        fd = os.open(directory, os.O_RDONLY)
+    except OSError:
+        return  # Not supported on this platform
+    try:
+        os.fsync(fd)
+    finally:
+        os.close(fd)
+
+
+def atomic_write_bytes(path, data, durable=False):
+    """Replace path with data atomically; fsync first when durable"""
+    directory = os.path.dirname(path) or '.'
+    # A unique temp name, so concurrent writers never share a temp file
+    fd, tmp_path = tempfile.mkstemp(dir=directory, prefix=os.path.basename(path) + '.',
+                                    suffix='.tmp')
+    try:
+        with os.fdopen(fd, 'wb') as f:
+            # mkstemp creates 0600; images must stay readable by a fronting nginx
+            os.fchmod(f.fileno(), 0o644)
+            f.write(data)
+            if durable:
+                f.flush()
+                os.fsync(f.fileno())
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+    if durable:
+        fsync_dir(directory)
+
+
+def atomic_write_json(path, data, durable=True):
+    """Write JSON state atomically (durable by default)"""
+    atomic_write_bytes(path, json.dumps(data).encode(), durable=durable)
@@ -1,27 +1,128 @@
-import requests
 import json
-from datetime import datetime
-from openai import OpenAI
+import os
+import threading
+import time
+import requests
+from requests.adapters import HTTPAdapter
+from urllib3.util.retry import Retry
 import config
-import base64
+from generation import ArchiveSink, get_engine, run_generation
+from storage import atomic_write_json
 
-client = OpenAI(api_key=config.OPENAI_API_KEY)
+ONE_CALL_URL = "https://api.openweathermap.org/data/3.0/onecall"
+
+class WeatherProvider:
+    """OpenWeather One Call client with a pooled session and a disk-backed TTL cache"""
+    
+    def __init__(self, cache_file, ttl, timeout=(5, 15)):
+        self.cache_file = cache_file
+        self.ttl = ttl
+        self.timeout = timeout
+        self._lock = threading.Lock()
+        self._session = None
+        self._cache = {'fetched': 0, 'weather': None, 'prompts': {}}
+        
+        if os.path.exists(cache_file):
+            try:
+                with open(cache_file, 'r') as f:
+                    self._cache.update(json.load(f))
+            except (OSError, ValueError) as e:
+                print(f"Could not load weather cache: {e}")
+    
+    def _get_session(self):
+        """One keep-alive session, retrying transient failures"""
+        if self._session is None:
+            retry = Retry(total=2, backoff_factor=1,
+                          status_forcelist=(429, 500, 502, 503, 504))
+            self._session = requests.Session()
+            self._session.mount('https://', HTTPAdapter(pool_maxsize=2, max_retries=retry))
+        return self._session
+    
+    def _save(self):
+        try:
+            atomic_write_json(self.cache_file, self._cache)
+        except OSError as e:
+            print(f"Could not save weather cache: {e}")
+    
+    def get_weather(self):
+        """Today's forecast, fetched at most once per TTL (also across restarts)"""
+        with self._lock:
+            if self._cache['weather'] and time.time() - self._cache['fetched'] < self.ttl:
+                return self._cache['weather']
+            
+            try:
+                response = self._get_session().get(ONE_CALL_URL, params={
+                    'lat': config.NYC_LAT,
+                    'lon': config.NYC_LON,
+                    'units': 'imperial',
+                    # Only daily[0] is used; skip the rest of the payload
+                    'exclude': 'current,minutely,hourly,alerts',
+                    'appid': config.OPENWEATHER_API_KEY
+                }, timeout=self.timeout)
+                response.raise_for_status()
+            except requests.RequestException:
+                if self._cache['weather']:
+                    print("Weather fetch failed, using cached forecast")
+                    return self._cache['weather']
+                raise
+            
+            self._cache['weather'] = response.json()
+            self._cache['fetched'] = time.time()
+            self._save()
+            return self._cache['weather']
+    
+    def cached_prompt(self, key):
+        with self._lock:
+            return self._cache['prompts'].get(key)
+    
+    def remember_prompt(self, key, prompt):
+        with self._lock:
+            prompts = self._cache['prompts']
+            prompts[key] = prompt
+            # Dicts keep insertion order, so the oldest prompts go first
+            for old_key in list(prompts)[:-config.WEATHER_PROMPT_MEMO_SIZE]:
+                del prompts[old_key]
+            self._save()
+
+weather_provider = WeatherProvider(config.WEATHER_CACHE_FILE, ttl=config.WEATHER_CACHE_TTL)
 
 def get_nyc_weather():
     """Fetch current weather for NYC"""
-    url = f"https://api.openweathermap.org/data/3.0/onecall?lat={config.NYC_LAT}&lon={config.NYC_LON}&units=imperial&appid={config.OPENWEATHER_API_KEY}"
-    
-    response = requests.get(url)
-    return response.json()
+    return weather_provider.get_weather()
 
-def generate_weather_prompt(weather_data):
-    """Use GPT-4.1 to create an artistic prompt from weather data"""
+def bucket_weather(weather_data):
+    """The values the prompt uses, rounded so similar days share a prompt"""
     today_weather = weather_data['daily'][0]
-    weather_desc = today_weather['summary']
-    temp = today_weather['temp']['day']
-    feels_like = today_weather['feels_like']['day']
-    humidity = today_weather['humidity']
-    wind_speed = today_weather['wind_speed']
+    return {
+        'summary': today_weather['summary'],
+        'temp': 5 * round(today_weather['temp']['day'] / 5),
+        'feels_like': 5 * round(today_weather['feels_like']['day'] / 5),
+        'humidity': 10 * round(today_weather['humidity'] / 10),
+        'wind_speed': 5 * round(today_weather['wind_speed'] / 5)
+    }
+
+def weather_snapshot(weather_data):
+    """The day's conditions as stored alongside the artwork in the catalog"""
+    today_weather = weather_data['daily'][0]
+    return {
+        'summary': today_weather.get('summary'),
+        'temp': today_weather['temp']['day'],
+        'feels_like': today_weather['feels_like']['day'],
+        'humidity': today_weather['humidity'],
+        'wind_speed': today_weather['wind_speed']
+    }
+
+def generate_weather_prompt(weather_data):
+    """Use GPT-4.1 to create an artistic prompt from weather data
+    
+    Memoized on the bucketed weather, so a repeat of the same conditions
+    reuses the prompt (and, through the prompt cache, the image).
+    """
+    weather = bucket_weather(weather_data)
+    memo_key = json.dumps(weather, sort_keys=True)
+    cached = weather_provider.cached_prompt(memo_key)
+    if cached:
+        return cached
         
     system_prompt = """You are an artistic AI that creates beautiful, evocative image generation prompts based on weather conditions. 
     Create prompts that capture the mood and atmosphere of the weather in an abstract, artistic way.
@@ -29,14 +130,15 @@ def generate_weather_prompt(weather_data):
     Make the prompts suitable for creating stunning digital art."""
     
     user_prompt = f"""Create an artistic image generation prompt based on this NYC weather:
-    - Weather: {weather_desc}
-    - Temperature: {temp}°F (feels like {feels_like}°F)
-    - Humidity: {humidity}%
-    - Wind: {wind_speed} mph
+    - Weather: {weather['summary']}
+    - Temperature: {weather['temp']}°F (feels like {weather['feels_like']}°F)
+    - Humidity: {weather['humidity']}%
+    - Wind: {weather['wind_speed']} mph
     
     Create a single, cohesive prompt that would result in a beautiful, abstract artwork that captures the essence of this weather."""
     
-    response = client.chat.completions.create(
+    # Shares the generation engine's client rather than building a second one
+    response = get_engine().complete_chat(
         model="gpt-4.1",
         messages=[
             {"role": "system", "content": system_prompt},
@@ -45,56 +147,41 @@ def generate_weather_prompt(weather_data):
         temperature=0.9
     )
     
-    return response.choices[0].message.content
+    prompt = response.choices[0].message.content
+    weather_provider.remember_prompt(memo_key, prompt)
+    return prompt
+
+def create_weather_art_prompt(weather=None):
+    """Turn the weather (fetched if not given) into a styled image prompt"""
+    weather = weather or get_nyc_weather()
+    art_prompt = generate_weather_prompt(weather)
+    print(f"Generated prompt: {art_prompt}")
+    
+    # Add style suffix
+    return f"{art_prompt}, {config.DEFAULT_STYLE}"
 
-def generate_weather_art():
-    """Main function to generate weather-based art"""
+def generate_weather_art(sinks=None, cancel_event=None, run_id=None, cache=None,
+                         partial_images=None, force_fresh=False):
+    """Main function to generate weather-based art
+    
+    Runs through the shared generation engine; by default the final image
+    is only archived.
+    """
     try:
-        # Get weather
         weather = get_nyc_weather()
+        full_prompt = create_weather_art_prompt(weather)
+        if sinks is None:
+            sinks = [ArchiveSink(config.IMAGES_DIR)]
         
-        # Generate prompt
-        art_prompt = generate_weather_prompt(weather)
-        print(f"Generated prompt: {art_prompt}")
-        
-        # Add style suffix
-        full_prompt = f"{art_prompt}, {config.DEFAULT_STYLE}"
-        
-        # Generate image using the new streaming API
-        stream = client.responses.create(
-            model="gpt-4.1",
-            input=full_prompt,
-            stream=True,
-            tools=[{"type": "image_generation", 
-                    "partial_images": config.PARTIAL_IMAGES,
-                    "quality":"high",
-                    "moderation":"low",
-                    "size":"1536x1024"
-                    }
-                    ],
-        )
-        
-        # Process stream and save the final image
-        final_image_data = None
-        for event in stream:
-            if event.type == "response.image_generation_call.partial_image":
-                idx = event.partial_image_index
-                image_base64 = event.partial_image_b64
-                image_bytes = base64.b64decode(image_base64)
-                
-                # Keep updating current image with each partial
-                with open(config.CURRENT_IMAGE, 'wb') as f:
-                    f.write(image_bytes)
-                
-                final_image_data = image_bytes
-                print(f"Received partial image {idx}")
-        
-        # Archive final image with timestamp
-        if final_image_data:
-            timestamp = datetime.now().strftime('%Y%m%d_%H%M%S')
-            archive_path = f"{config.IMAGES_DIR}/weather_art_{timestamp}.png"
-            with open(archive_path, 'wb') as f:
-                f.write(final_image_data)
+        run = run_generation(full_prompt, sinks, source='weather',
+                             cancel_event=cancel_event, run_id=run_id, cache=cache,
+                             force_fresh=force_fresh,
+                             metadata={'weather': weather_snapshot(weather)},
+                             partial_images=partial_images)
+        if run.cached:
+            return True, "Weather art served from cache"
+        if run.final_bytes is None:
+            return False, "Weather art stream produced no image"
         
         return True, "Weather art generated successfully"
         
@@ -103,4 +190,4 @@ def generate_weather_art():
 
 if __name__ == "__main__":
     success, message = generate_weather_art()
-    print(message)
\ No newline at end of file
+    print(message)